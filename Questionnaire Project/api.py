@@ -1,33 +1,87 @@
 import os
+import json
+import time
 import asyncio
-from typing import List, Dict
-from user_choices import current_user_choices
+import hashlib
+import weakref
+import contextlib
+from typing import List, Dict, Optional
+from user_choices import USER_CHOICES
 from datetime import datetime, timedelta
 from pydantic import BaseModel
-import pandas as pd
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, Response
 import uvicorn
 
-from './BBP Generation/generate_bbp.py' import generate_bbp_from_qa
-
 from dotenv import load_dotenv
+from core.concurrency import LLMCapacityError
+from core.metrics import registry, CONTENT_TYPE
+from core.session_store import SessionStore, SESSION_DB_PATH
 from process_analysis import (
-    generate_process_understanding,
-    update_process_understanding_with_input,
-    generate_process_recommendation
+    agenerate_process_understanding,
+    aupdate_process_understanding_incremental,
+    aupdate_process_understanding_with_input,
+    agenerate_process_recommendation,
+    astream_process_understanding,
+    astream_process_recommendation
 )
 
+from prefetch import AsyncSuggestedQuestionPrefetcher
+from generate_suggested_questions import agenerate_suggested_questions
+from vector_utils import build_subprocess_contexts, get_vectorstore, vectorstore_ready
+
 load_dotenv(dotenv_path="local.env", override=True)
 
 
-conversation_history = []
+DEFAULT_SESSION_ID = "default"
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+
+
+def new_session_state() -> dict:
+    return {
+        "history": [],
+        "user_choices": dict(USER_CHOICES),
+        "summaries": {"process_understanding": "", "understanding_watermark": []},
+    }
+
+
+session_store = SessionStore(SESSION_DB_PATH, default_factory=new_session_state)
+_session_locks = weakref.WeakValueDictionary()
+question_prefetcher = AsyncSuggestedQuestionPrefetcher()
+warmup_error = None
+
+HTTP_IN_FLIGHT = registry.gauge("http_requests_in_flight", "HTTP requests currently being handled.")
+HTTP_DURATION = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response starts.", ("method", "route", "status")
+)
+
+
+async def warm_up_vectorstore():
+    """Opens and syncs the vectorstore off the event loop so /health answers immediately."""
+    global warmup_error
+    try:
+        await asyncio.to_thread(get_vectorstore)
+        print("[STARTUP] Vectorstore ready")
+    except Exception as e:
+        warmup_error = str(e)
+        print(f"[STARTUP] Vectorstore warm-up failed: {e}")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup = asyncio.create_task(warm_up_vectorstore())
+    yield
+    warmup.cancel()
+    session_store.close()
+
 
 app = FastAPI(
     title="SAP BBP Discovery Assistant API",
     description="API backend for SAP Ariba BBP process understanding and recommendation",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -38,8 +92,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_DURATION.observe(time.perf_counter() - start, method=request.method, route=route, status=status)
+        HTTP_IN_FLIGHT.dec()
+
 class ConversationHistoryRequest(BaseModel):
-    history: List[Dict]
+    history: Optional[List[Dict]] = None
+    full_rebuild: bool = False
 
 class QAInput(BaseModel):
     question: str
@@ -52,96 +121,307 @@ class CorrectionUpdateRequest(BaseModel):
 
 class CustomerContextRequest(BaseModel):
     context: Dict[str, str]
+
+class FollowupInput(BaseModel):
+    followup_question: str
+    followup_answer: str
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    history: List[Dict]
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    tasks: List[str] = ["process_understanding", "process_recommendation"]
+
+class SuggestedQuestionRequest(BaseModel):
+    history: Optional[List[Dict]] = None
+    sub_process_name: str
+    rag_context: str = ""
     
-def add_main_qa(question: str, answer: str):
-    conversation_history.append({
-        "question": question,
-        "answer": answer,
-        "followups": []
-    })
-def add_followup(followup_question: str, followup_answer: str):
-    if not conversation_history:
-        raise ValueError("No main Q&A exists yet.")
-    conversation_history[-1]["followups"].append({
-        "question": followup_question,
-        "answer": followup_answer
-    })
+def add_main_qa(session_id: str, question: str, answer: str, subprocess: str = None):
+    with session_store.edit(session_id) as state:
+        state["history"].append({
+            "question": question,
+            "answer": answer,
+            "followups": [],
+            "subprocess": subprocess
+        })
+def add_followup(session_id: str, followup_question: str, followup_answer: str):
+    with session_store.edit(session_id) as state:
+        if not state["history"]:
+            raise ValueError("No main Q&A exists yet.")
+        state["history"][-1]["followups"].append({
+            "question": followup_question,
+            "answer": followup_answer
+        })
+
+def update_user_choices(session_id: str, updates: dict):
+    with session_store.edit(session_id) as state:
+        state["user_choices"].update(updates)
+
+def session_lock(session_id: str) -> asyncio.Lock:
+    """Serialises read-generate-write updates of one session's state within this process."""
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = _session_locks[session_id] = asyncio.Lock()
+    return lock
+
+async def get_session_state(session_id: str) -> dict:
+    # The store may read SQLite, so keep it off the event loop.
+    return await asyncio.to_thread(session_store.get, session_id)
+
+async def session_history(session_id: str, history: Optional[List[Dict]]) -> List[Dict]:
+    """Uses the history sent with the request, falling back to the one stored for the session."""
+    if history is not None:
+        return history
+    return (await get_session_state(session_id))["history"]
+
+def store_understanding(session_id: str, summaries: dict):
+    with session_store.edit(session_id) as state:
+        state["summaries"].update(summaries)
+
+def sse_response(token_stream) -> StreamingResponse:
+    """Wraps an async token generator as a text/event-stream response."""
+    async def event_stream():
+        try:
+            async for token in token_stream:
+                yield f"data: {json.dumps({'token': token})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 
 
 
 @app.post("/update_sap_product")
-async def update_sap_product(product: str = Body(...)):
+async def update_sap_product(product: str = Body(...), x_session_id: str = Header(DEFAULT_SESSION_ID)):
     try:
-        current_user_choices["product"] = product
+        await asyncio.to_thread(update_user_choices, x_session_id, {"product": product})
         print(f"[PRODUCT UPDATED] {product}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
 @app.post("/update_module")
-async def update_module(module: str = Body(...)):
+async def update_module(module: str = Body(...), x_session_id: str = Header(DEFAULT_SESSION_ID)):
     try:
-        current_user_choices["module"] = module
+        await asyncio.to_thread(update_user_choices, x_session_id, {"module": module})
         print(f"[MODULE UPDATED] {module}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
 @app.post("/update_activity")
-async def update_activity(activity: str = Body(...)):
+async def update_activity(activity: str = Body(...), x_session_id: str = Header(DEFAULT_SESSION_ID)):
     try:
-        current_user_choices["activity"] = activity
+        await asyncio.to_thread(update_user_choices, x_session_id, {"activity": activity})
         print(f"[ACTIVITY UPDATED] {activity}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
 @app.post("/update_customer_context")
-async def update_customer_context(payload: Dict[str, Dict[str, str]]):
+async def update_customer_context(payload: Dict[str, Dict[str, str]], x_session_id: str = Header(DEFAULT_SESSION_ID)):
     try:
         context = payload.get("context", {})
-        for key, value in context.items():
-            current_user_choices[key] = value
+        await asyncio.to_thread(update_user_choices, x_session_id, context)
         print("[CONTEXT UPDATED]", context)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
     
 app.post("/update_bbp_generation_journey")
-async def update_sap_product(product: str = Body(...)):
+async def update_sap_product(product: str = Body(...), x_session_id: str = Header(DEFAULT_SESSION_ID)):
     try:
-        current_user_choices["product"] = product
+        await asyncio.to_thread(update_user_choices, x_session_id, {"product": product})
         print(f"[PRODUCT UPDATED] {product}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
 
 
+@app.get("/session")
+async def get_session(x_session_id: str = Header(DEFAULT_SESSION_ID)):
+    return await get_session_state(x_session_id)
+
+@app.post("/session/qa")
+async def add_session_qa(qa: QAInput, subprocess: Optional[str] = None, x_session_id: str = Header(DEFAULT_SESSION_ID)):
+    await asyncio.to_thread(add_main_qa, x_session_id, qa.question, qa.answer, subprocess)
+    return {"status": "success"}
+
+@app.post("/session/followup")
+async def add_session_followup(followup: FollowupInput, x_session_id: str = Header(DEFAULT_SESSION_ID)):
+    try:
+        await asyncio.to_thread(add_followup, x_session_id, followup.followup_question, followup.followup_answer)
+        return {"status": "success"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/session")
+async def delete_session(x_session_id: str = Header(DEFAULT_SESSION_ID)):
+    await asyncio.to_thread(session_store.delete, x_session_id)
+    return {"status": "deleted"}
+
 @app.post("/generate_process_understanding")
-async def get_process_understanding(request: ConversationHistoryRequest):
+async def get_process_understanding(request: ConversationHistoryRequest, x_session_id: str = Header(DEFAULT_SESSION_ID)):
     try:
-        result = await run_in_threadpool(generate_process_understanding, request.history)
+        if request.history is not None:
+            # A client-supplied history is not the session's: build from scratch and leave the session alone.
+            return {"process_understanding": await agenerate_process_understanding(request.history)}
+        async with session_lock(x_session_id):
+            state = await get_session_state(x_session_id)
+            summaries = state["summaries"]
+            result, watermark = await aupdate_process_understanding_incremental(
+                state["history"],
+                summaries["process_understanding"],
+                summaries["understanding_watermark"],
+                full_rebuild=request.full_rebuild
+            )
+            await asyncio.to_thread(
+                store_understanding, x_session_id, {"process_understanding": result, "understanding_watermark": watermark}
+            )
         return {"process_understanding": result}
+    except LLMCapacityError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate_process_understanding/stream")
+async def stream_process_understanding(request: ConversationHistoryRequest, x_session_id: str = Header(DEFAULT_SESSION_ID)):
+    return sse_response(astream_process_understanding(await session_history(x_session_id, request.history)))
+
 @app.post("/update_process_understanding")
-async def update_process_understanding(request: CorrectionUpdateRequest):
+async def update_process_understanding(request: CorrectionUpdateRequest, x_session_id: str = Header(DEFAULT_SESSION_ID)):
     try:
-        result = await run_in_threadpool(
-            update_process_understanding_with_input,
-            request.history,
-            request.correction,
-            request.current_understanding
-        )
+        async with session_lock(x_session_id):
+            result = await aupdate_process_understanding_with_input(
+                request.history,
+                request.correction,
+                request.current_understanding
+            )
+            await asyncio.to_thread(store_understanding, x_session_id, {"process_understanding": result})
         return {"updated_process_understanding": result}
+    except LLMCapacityError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate_process_recommendation")
-async def get_process_recommendation(request: ConversationHistoryRequest):
+async def get_process_recommendation(request: ConversationHistoryRequest, x_session_id: str = Header(DEFAULT_SESSION_ID)):
     try:
-        result = await run_in_threadpool(generate_process_recommendation, request.history)
+        result = await agenerate_process_recommendation(await session_history(x_session_id, request.history))
         return {"process_recommendation": result}
+    except LLMCapacityError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/generate_process_recommendation/stream")
+async def stream_process_recommendation(request: ConversationHistoryRequest, x_session_id: str = Header(DEFAULT_SESSION_ID)):
+    return sse_response(astream_process_recommendation(await session_history(x_session_id, request.history)))
+
+BATCH_TASKS = {
+    "process_understanding": agenerate_process_understanding,
+    "process_recommendation": agenerate_process_recommendation,
+}
+
+def history_fingerprint(history: List[Dict]) -> str:
+    return hashlib.sha256(json.dumps(history, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+async def run_batch(items: List[BatchItem], tasks: List[str]):
+    """
+    Runs every requested task for every item, at most BATCH_MAX_CONCURRENCY at
+    a time, and yields one NDJSON line per (item, task) as results complete.
+    Items with identical histories share a single generation per task.
+    """
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    jobs = {}
+    histories = {}
+    for index, item in enumerate(items):
+        item_id = item.id if item.id is not None else str(index)
+        key = history_fingerprint(item.history)
+        histories[key] = item.history
+        for task in tasks:
+            jobs.setdefault((task, key), []).append(item_id)
+
+    async def run(job):
+        task, key = job
+        async with semaphore:
+            try:
+                return job, {"result": await BATCH_TASKS[task](histories[key])}
+            except LLMCapacityError as e:
+                return job, {"error": str(e), "status": 503}
+            except Exception as e:
+                return job, {"error": str(e), "status": 500}
+
+    pending = [asyncio.create_task(run(job)) for job in jobs]
+    try:
+        for next_done in asyncio.as_completed(pending):
+            (task, key), outcome = await next_done
+            for item_id in jobs[(task, key)]:
+                yield json.dumps({"id": item_id, "task": task, **outcome}, ensure_ascii=False) + "\n"
+    finally:
+        # Client went away or the stream failed: stop the remaining generations.
+        for job_task in pending:
+            job_task.cancel()
+
+@app.post("/batch")
+async def batch(request: BatchRequest):
+    unknown = [task for task in request.tasks if task not in BATCH_TASKS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown tasks: {', '.join(unknown)}. Supported: {', '.join(BATCH_TASKS)}")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch.")
+    return StreamingResponse(run_batch(request.items, request.tasks), media_type="application/x-ndjson")
+
+async def resolve_rag_context(rag_context: str, sub_process_name: str) -> str:
+    if rag_context:
+        return rag_context
+    contexts = await asyncio.to_thread(build_subprocess_contexts, [sub_process_name])
+    return contexts[sub_process_name]
+
+@app.post("/prefetch_suggested_question")
+async def prefetch_suggested_question(request: SuggestedQuestionRequest, x_session_id: str = Header(DEFAULT_SESSION_ID)):
+    state = await get_session_state(x_session_id)
+    history = state["history"] if request.history is None else request.history
+    rag_context = await resolve_rag_context(request.rag_context, request.sub_process_name)
+    question_prefetcher.submit(
+        user_choices=state["user_choices"],
+        rag_context=rag_context,
+        conversation_history=history,
+        sub_process_name=request.sub_process_name,
+        owner=x_session_id
+    )
+    return {"status": "scheduled"}
+
+@app.post("/generate_suggested_question")
+async def get_suggested_question(request: SuggestedQuestionRequest, x_session_id: str = Header(DEFAULT_SESSION_ID)):
+    try:
+        state = await get_session_state(x_session_id)
+        history = state["history"] if request.history is None else request.history
+        rag_context = await resolve_rag_context(request.rag_context, request.sub_process_name)
+        questions = await question_prefetcher.result(
+            user_choices=state["user_choices"],
+            rag_context=rag_context,
+            conversation_history=history,
+            sub_process_name=request.sub_process_name,
+            owner=x_session_id
+        )
+        if questions is None:
+            questions = await agenerate_suggested_questions(
+                user_choices=state["user_choices"],
+                rag_context=rag_context,
+                conversation_history=history,
+                sub_process_name=request.sub_process_name
+            )
+        return {"suggested_questions": questions}
+    except LLMCapacityError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -149,5 +429,16 @@ async def get_process_recommendation(request: ConversationHistoryRequest):
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
+@app.get("/ready")
+async def readiness_check():
+    if not vectorstore_ready():
+        detail = f"Vectorstore warm-up failed: {warmup_error}" if warmup_error else "Vectorstore is warming up"
+        raise HTTPException(status_code=503, detail=detail)
+    return {"status": "ready"}
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
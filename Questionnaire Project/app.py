@@ -1,11 +1,13 @@
 import streamlit as st
 from generate_suggested_questions import generate_suggested_questions
 from generate_followups import generate_all_followups
-from vector_utils import load_documents, create_or_load_vectorstore, get_rag_context
+from prefetch import SuggestedQuestionPrefetcher
+from vector_utils import build_rag_context, build_subprocess_contexts
 from extract_subprocesses import extract_subprocesses
+from probing_focus import resolve_subprocesses
 from user_choices import USER_CHOICES
 from core.models import llm_instance
-from process_analysis import generate_process_understanding, revise_process_understanding, generate_process_recommendation, revise_process_recommendation
+from process_analysis import update_process_understanding_incremental, revise_process_understanding, generate_process_recommendation, revise_process_recommendation
 
 # Page config
 st.set_page_config(page_title="SAP BBP Discovery Assistant", layout="wide")
@@ -18,6 +20,7 @@ if "conversation_history" not in st.session_state:
     st.session_state.followups = []
     st.session_state.step = "question"
     st.session_state.process_understanding = ""
+    st.session_state.understanding_watermark = []
     st.session_state.process_recommendation = ""
 
 if "subprocess_list" not in st.session_state:
@@ -29,7 +32,39 @@ if "selected_subprocess" not in st.session_state:
 
 if "rag_context" not in st.session_state or not st.session_state.rag_context:
     with st.spinner("Loading documents and building context..."):
-        st.session_state.rag_context = get_rag_context()
+        st.session_state.rag_context = build_rag_context()
+
+if "subprocess_contexts" not in st.session_state:
+    with st.spinner("Retrieving context for each sub-process..."):
+        st.session_state.subprocess_contexts = build_subprocess_contexts(st.session_state.subprocess_list)
+        resolve_subprocesses(st.session_state.subprocess_list)
+
+
+def rag_context_for(sub_process_name: str) -> str:
+    """Sub-process specific RAG context, falling back to the generic session context."""
+    return st.session_state.subprocess_contexts.get(sub_process_name) or st.session_state.rag_context
+
+if "prefetcher" not in st.session_state:
+    st.session_state.prefetcher = SuggestedQuestionPrefetcher()
+
+
+def prefetch_next_question():
+    """Starts generating the next subprocess's question in the background."""
+    next_index = st.session_state.current_subprocess_index + 1
+    if next_index < len(st.session_state.subprocess_list):
+        next_subprocess = st.session_state.subprocess_list[next_index]
+        st.session_state.prefetcher.submit(
+            user_choices=USER_CHOICES,
+            rag_context=rag_context_for(next_subprocess),
+            conversation_history=st.session_state.conversation_history,
+            sub_process_name=next_subprocess
+        )
+
+
+def submit_followup_answer(i: int):
+    """Records a submitted follow-up answer and re-prefetches for the updated history."""
+    st.session_state.followups[i]["answer"] = st.session_state[f"fq_{i}"]
+    prefetch_next_question()
 
 # View subprocess list
 with st.expander("📄 View All Sub-Processes"):
@@ -40,12 +75,19 @@ with st.expander("📄 View All Sub-Processes"):
 if st.session_state.step == "question":
     st.session_state.selected_subprocess = st.session_state.subprocess_list[st.session_state.current_subprocess_index]
     with st.spinner("Generating suggested question..."):
-        suggested = generate_suggested_questions(
+        suggested = st.session_state.prefetcher.result(
             user_choices=USER_CHOICES,
             sub_process_name=st.session_state.selected_subprocess,
-            rag_context=st.session_state.rag_context,
+            rag_context=rag_context_for(st.session_state.selected_subprocess),
             conversation_history=st.session_state.conversation_history
         )
+        if suggested is None:
+            suggested = generate_suggested_questions(
+                user_choices=USER_CHOICES,
+                sub_process_name=st.session_state.selected_subprocess,
+                rag_context=rag_context_for(st.session_state.selected_subprocess),
+                conversation_history=st.session_state.conversation_history
+            )
         if suggested:
             st.session_state.current_question = suggested[0]
             st.session_state.followups = []
@@ -74,7 +116,7 @@ if st.session_state.step == "await_answer":
                 followups = generate_all_followups(
                     question=st.session_state.current_question,
                     answer=main_answer,
-                    rag_context=st.session_state.rag_context,
+                    rag_context=rag_context_for(st.session_state.selected_subprocess),
                     conversation_history=st.session_state.conversation_history
                 )
             st.session_state.followups = followups
@@ -85,11 +127,17 @@ if st.session_state.step == "await_answer":
             st.session_state.conversation_history.append({
                 "question": st.session_state.current_question,
                 "answer": main_answer,
-                "followups": followups
+                "followups": followups,
+                "subprocess": st.session_state.selected_subprocess
             })
+            prefetch_next_question()
             with st.spinner("🔍 Updating Process Understanding..."):
                 convo = st.session_state.conversation_history
-                st.session_state.process_understanding = generate_process_understanding(convo)
+                st.session_state.process_understanding, st.session_state.understanding_watermark = update_process_understanding_incremental(
+                    convo,
+                    current_summary=st.session_state.process_understanding,
+                    watermark=st.session_state.understanding_watermark
+                )
 
             st.rerun()
 
@@ -102,7 +150,9 @@ if st.session_state.step == "followups":
 
     st.subheader("🔍 Follow-Up Questions")
     for i, f in enumerate(st.session_state.followups):
-        f["answer"] = st.text_input(f"Follow-up {i+1}: {f['question']}", key=f"fq_{i}")
+        f["answer"] = st.text_input(
+            f"Follow-up {i+1}: {f['question']}", key=f"fq_{i}", on_change=submit_followup_answer, args=(i,)
+        )
 
     col1, col2, col3 = st.columns([1, 1, 1])
 
@@ -133,6 +183,13 @@ if st.session_state.step == "followups":
             )
             st.session_state.process_understanding = updated
             st.rerun()
+        if st.button("♻️ Rebuild Process Understanding"):
+            with st.spinner("🔍 Rebuilding Process Understanding from the full conversation..."):
+                st.session_state.process_understanding, st.session_state.understanding_watermark = update_process_understanding_incremental(
+                    st.session_state.conversation_history,
+                    full_rebuild=True
+                )
+            st.rerun()
 
     with col3:
         if st.button("🛠️ Generate Process Recommendation"):
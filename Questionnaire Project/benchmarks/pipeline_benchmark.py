@@ -0,0 +1,234 @@
+# benchmarks/pipeline_benchmark.py
+#
+# Times each pipeline stage end-to-end against local fixtures.
+#
+#   python benchmarks/pipeline_benchmark.py                      # offline fake models
+#   python benchmarks/pipeline_benchmark.py --backend replay     # recorded Azure responses
+#   python benchmarks/pipeline_benchmark.py --llm-latency 0.8 --repeat 5 --json results.json
+#
+# Record a replay set once with network access:
+#   python benchmarks/pipeline_benchmark.py --backend record --repeat 1
+#
+# The index is built in a throwaway directory and the LLM/embedding caches are
+# off unless --with-caches is given, so every repeat measures real work.
+
+import os
+import sys
+import json
+import asyncio
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(PROJECT_DIR, "benchmarks", "fixtures")
+
+STAGES = [
+    "document_loading",
+    "index_build",
+    "index_noop",
+    "retrieval",
+    "retrieval_vector",
+    "retrieval_lexical",
+    "retrieval_batch",
+    "question_generation",
+    "followups",
+    "understanding",
+    "recommendation",
+    "recommendation_stream",
+]
+
+
+def configure_environment(args, work_dir: str):
+    """Must run before any project module is imported: core.models reads its config at import."""
+    os.environ["LLM_BACKEND"] = args.backend
+    os.environ["EMBEDDING_BACKEND"] = "hash" if args.backend == "fake" else args.backend
+    os.environ["FAKE_LLM_LATENCY_SECONDS"] = str(args.llm_latency)
+    os.environ["FAKE_LLM_TOKEN_LATENCY_SECONDS"] = str(args.token_latency)
+    os.environ["FAKE_EMBEDDING_LATENCY_SECONDS"] = str(args.embedding_latency)
+    os.environ["VECTOR_BACKEND"] = args.vector_backend
+    os.environ["DOCS_FOLDER"] = os.path.abspath(args.docs)
+    os.environ["VECTOR_DB_PATH"] = os.path.join(work_dir, "vectorstore")
+    if not args.with_caches:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+        os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+    os.chdir(PROJECT_DIR)
+    sys.path.insert(0, PROJECT_DIR)
+
+
+def run_stage(fn, repeat: int) -> dict:
+    timings = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}", "runs": len(timings)}
+    return {
+        "runs": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "max": max(timings),
+    }
+
+
+def expect_output(fn):
+    """
+    Wraps an LLM stage so an empty result or an error placeholder counts as a
+    failure: the generators swallow model errors and return "" / [] / an
+    "[Error ...]" line, which would otherwise be timed as a fast success.
+    """
+    def run():
+        result = fn()
+        unusable = not result or (
+            isinstance(result, list) and any(isinstance(item, str) and item.startswith("[Error") for item in result)
+        )
+        if unusable:
+            raise RuntimeError(f"no usable output: {str(result)[:200]!r}")
+        return result
+    return run
+
+
+def build_stages(fixture: dict, work_dir: str) -> dict:
+    import vector_utils
+    from user_choices import USER_CHOICES
+    from generate_suggested_questions import generate_suggested_questions
+    from generate_followups import generate_all_followups
+    import process_analysis
+    from process_analysis import generate_process_understanding, generate_process_recommendation
+
+    history = fixture["history"]
+    subprocesses = fixture["subprocesses"]
+    current = fixture["current_subprocess"]
+    pending = fixture["pending_qa"]
+    builds = {"count": 0}
+    contexts = {}
+
+    def index_build():
+        # A fresh directory per repeat, so each run embeds the whole corpus.
+        builds["count"] += 1
+        vector_utils.VECTOR_DB_PATH = os.path.join(work_dir, f"vectorstore-{builds['count']}")
+        vector_utils.MANIFEST_PATH = os.path.join(vector_utils.VECTOR_DB_PATH, vector_utils.MANIFEST_FILENAME)
+        vector_utils._vectorstore = None
+        vector_utils._retrievers.clear()
+        vector_utils._chunk_matrix = None
+        vector_utils._lexical_index = None
+        vector_utils.get_vectorstore()
+
+    def retrieval():
+        for name in subprocesses:
+            contexts[name] = vector_utils.build_rag_context(k=4, query=name)
+
+    def retrieval_vector():
+        for name in subprocesses:
+            vector_utils.search_chunks(name, k=4, mode="vector")
+
+    def retrieval_lexical():
+        for name in subprocesses:
+            vector_utils.search_chunks(name, k=4, mode="lexical")
+
+    def recommendation():
+        # Sections are cached by their Q&A; clear them so each repeat drafts every section.
+        process_analysis._section_cache.clear()
+        return generate_process_recommendation(history)
+
+    def recommendation_stream():
+        # The first chunk must not wait for the whole map step: when it arrives,
+        # at least one section should still be undrafted.
+        process_analysis._section_cache.clear()
+
+        async def consume():
+            chunks, drafted_at_first_chunk = [], None
+            async for chunk in process_analysis.astream_process_recommendation(history):
+                if drafted_at_first_chunk is None:
+                    drafted_at_first_chunk = len(process_analysis._section_cache)
+                chunks.append(chunk)
+            return chunks, drafted_at_first_chunk
+
+        chunks, drafted_at_first_chunk = asyncio.run(consume())
+        section_count = len(process_analysis.group_history_by_subprocess(history))
+        if process_analysis.use_map_reduce(history) and drafted_at_first_chunk >= section_count:
+            raise RuntimeError(f"first chunk arrived after all {section_count} sections were drafted")
+        return "".join(chunks)
+
+    def retrieval_batch():
+        vector_utils._chunk_matrix = None
+        vector_utils.retrieve_batch(subprocesses, k=4)
+
+    return {
+        "document_loading": vector_utils.load_documents,
+        "index_build": index_build,
+        "index_noop": vector_utils.refresh_vectorstore,
+        "retrieval": retrieval,
+        "retrieval_vector": retrieval_vector,
+        "retrieval_lexical": retrieval_lexical,
+        "retrieval_batch": retrieval_batch,
+        "question_generation": expect_output(lambda: generate_suggested_questions(
+            user_choices=USER_CHOICES,
+            rag_context=contexts.get(current, ""),
+            conversation_history=history,
+            sub_process_name=current,
+        )),
+        "followups": expect_output(lambda: generate_all_followups(
+            pending["question"], pending["answer"], contexts.get(current, ""), history
+        )),
+        "understanding": expect_output(lambda: generate_process_understanding(history)),
+        "recommendation": expect_output(recommendation),
+        "recommendation_stream": expect_output(recommendation_stream),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage end-to-end.")
+    parser.add_argument("--backend", choices=["fake", "record", "replay", "azure"], default="fake")
+    parser.add_argument("--vector-backend", choices=["chroma", "mmap"], default="chroma")
+    parser.add_argument("--docs", default=os.path.join(PROJECT_DIR, "docs"), help="Folder of .docx/.pdf sources.")
+    parser.add_argument("--fixture", default=os.path.join(FIXTURES_DIR, "discovery_session.json"))
+    parser.add_argument("--stages", nargs="*", default=STAGES, choices=STAGES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Fake backend: seconds per LLM call.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Fake backend: seconds per generated word.")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Fake backend: seconds per embedding call.")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the LLM and embedding caches enabled.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    with open(args.fixture, "r", encoding="utf-8") as f:
+        fixture = json.load(f)
+
+    work_dir = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    try:
+        configure_environment(args, work_dir)
+        stages = build_stages(fixture, work_dir)
+
+        results = {}
+        print(f"backend={args.backend} vector_backend={args.vector_backend} repeat={args.repeat} docs={args.docs}")
+        print(f"{'stage':<22}{'min (s)':>10}{'median (s)':>12}{'mean (s)':>10}")
+        # Stages run in pipeline order; later ones rely on the index built earlier.
+        for name in STAGES:
+            if name not in args.stages and name != "index_build":
+                continue
+            result = run_stage(stages[name], args.repeat if name in args.stages else 1)
+            if name not in args.stages:
+                continue
+            results[name] = result
+            if "error" in result:
+                print(f"{name:<22}  failed: {result['error']}")
+            else:
+                print(f"{name:<22}{result['min']:>10.3f}{result['median']:>12.3f}{result['mean']:>10.3f}")
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"backend": args.backend, "repeat": args.repeat, "stages": results}, f, indent=2)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
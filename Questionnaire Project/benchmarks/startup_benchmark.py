@@ -0,0 +1,67 @@
+# benchmarks/startup_benchmark.py
+#
+# Measures cold-start import cost of the entry points in fresh interpreters.
+#
+#   python benchmarks/startup_benchmark.py                 # api + CLI, 5 runs each
+#   python benchmarks/startup_benchmark.py --runs 10 --top 15 api
+#
+# Each run imports the module in a new `python -X importtime` process, so
+# nothing is shared between runs; --top lists the slowest imports of the last
+# run by cumulative time.
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ["api", "extract_subprocesses", "core.models"]
+
+
+def time_import(module: str) -> tuple:
+    """Imports `module` in a fresh interpreter; returns (wall seconds, importtime rows)."""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"import {module} failed:\n" + "\n".join(errors[-10:]))
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|", 1).split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    return elapsed, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold-start import time.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="Show the N slowest imports of the last run.")
+    args = parser.parse_args()
+
+    print(f"{'module':<24}{'min (s)':>10}{'median (s)':>12}{'max (s)':>10}")
+    for module in args.modules:
+        timings = []
+        rows = []
+        for _ in range(args.runs):
+            elapsed, rows = time_import(module)
+            timings.append(elapsed)
+        print(f"{module:<24}{min(timings):>10.3f}{statistics.median(timings):>12.3f}{max(timings):>10.3f}")
+        if args.top:
+            for cumulative_us, self_us, name in sorted(rows, reverse=True)[:args.top]:
+                print(f"    {cumulative_us / 1000:>9.1f} ms  {name.strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# benchmarks/vector_backend_benchmark.py
+#
+# Compares the Chroma and memory-mapped float16 vector backends on build time,
+# load time, memory and query latency over a synthetic corpus.
+#
+#   python benchmarks/vector_backend_benchmark.py                         # 50k x 1536, exact search
+#   python benchmarks/vector_backend_benchmark.py --rows 200000 --ivf-lists 256 --ivf-probe 16
+#   python benchmarks/vector_backend_benchmark.py --backends mmap --mmap-dtype float32 --json results.json
+#
+# Vectors are clustered Gaussians, so nearest neighbours behave roughly like
+# real embeddings. Each backend is opened and queried in a fresh interpreter,
+# so load time and memory are measured from a cold process; "private" memory
+# is what every additional worker process pays again, "shared" is file-backed
+# pages the OS page cache serves to all workers once.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ["chroma", "mmap"]
+CHROMA_BATCH_SIZE = 5000
+
+
+def make_corpus(rows: int, dim: int, queries: int, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, rows // 250), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), rows)] + 0.5 * rng.normal(size=(rows, dim)).astype(np.float32)
+    query_vectors = centers[rng.integers(0, len(centers), queries)] + 0.5 * rng.normal(size=(queries, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return vectors, query_vectors
+
+
+def exact_neighbours(vectors: np.ndarray, query_vectors: np.ndarray, k: int) -> list:
+    scores = query_vectors @ vectors.T
+    return [set(row) for row in np.argpartition(-scores, k - 1, axis=1)[:, :k].tolist()]
+
+
+def build(backend: str, path: str, vectors: np.ndarray, mmap_dtype: str) -> float:
+    ids = [str(i) for i in range(len(vectors))]
+    texts = [f"chunk {i}" for i in ids]
+    start = time.perf_counter()
+    if backend == "chroma":
+        import chromadb
+
+        collection = chromadb.PersistentClient(path=path).get_or_create_collection("langchain")
+        for offset in range(0, len(ids), CHROMA_BATCH_SIZE):
+            end = offset + CHROMA_BATCH_SIZE
+            collection.add(ids=ids[offset:end], embeddings=vectors[offset:end].tolist(), documents=texts[offset:end])
+    else:
+        from mmap_vector_store import MmapVectorStore
+
+        store = MmapVectorStore(path, None, dtype=mmap_dtype)
+        for offset in range(0, len(ids), CHROMA_BATCH_SIZE):
+            end = offset + CHROMA_BATCH_SIZE
+            store.add_vectors(ids[offset:end], vectors[offset:end], texts[offset:end])
+    return time.perf_counter() - start
+
+
+def memory_mb() -> dict:
+    """Private (anonymous) and shared (file-backed) resident memory of this process, in MB."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {
+            "private_mb": int(fields["RssAnon"].split()[0]) / 1024,
+            "shared_mb": int(fields["RssFile"].split()[0]) / 1024,
+        }
+    except (OSError, KeyError):
+        import resource
+
+        return {"private_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "shared_mb": None}
+
+
+def child(args):
+    """Runs in a fresh interpreter: opens one backend, queries it and prints JSON."""
+    sys.path.insert(0, PROJECT_DIR)
+    query_vectors = np.load(args.queries_file)
+    if args.child == "chroma":
+        import chromadb
+
+        def search(vector):
+            return [int(i) for i in collection.query(query_embeddings=[vector.tolist()], n_results=args.k)["ids"][0]]
+    else:
+        from mmap_vector_store import MmapVectorStore
+
+        def search(vector):
+            return [int(i) for i, _ in store.search_vectors(vector, args.k)[0]]
+
+    baseline = memory_mb()
+    start = time.perf_counter()
+    if args.child == "chroma":
+        collection = chromadb.PersistentClient(path=args.path).get_collection("langchain")
+    else:
+        store = MmapVectorStore(args.path, None, ivf_lists=args.ivf_lists, ivf_probe=args.ivf_probe, ivf_min_rows=0)
+        len(store)
+    open_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = [search(query_vectors[0])]
+    first_query_seconds = time.perf_counter() - start
+
+    latencies = []
+    for vector in query_vectors[1:]:
+        start = time.perf_counter()
+        results.append(search(vector))
+        latencies.append(time.perf_counter() - start)
+
+    memory = memory_mb()
+    print(json.dumps({
+        "open_seconds": open_seconds,
+        "first_query_seconds": first_query_seconds,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000) if latencies else None,
+        "p95_ms": float(np.percentile(latencies, 95) * 1000) if latencies else None,
+        "private_mb": memory["private_mb"] - baseline["private_mb"],
+        "shared_mb": None if memory["shared_mb"] is None else memory["shared_mb"] - baseline["shared_mb"],
+        "results": results,
+    }))
+
+
+def measure(backend: str, path: str, queries_file: str, args) -> dict:
+    result = subprocess.run(
+        [
+            sys.executable, os.path.abspath(__file__), "--child", backend, "--path", path,
+            "--queries-file", queries_file, "--k", str(args.k),
+            "--ivf-lists", str(args.ivf_lists), "--ivf-probe", str(args.ivf_probe),
+        ],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{backend} run failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Chroma and mmap vector backends.")
+    parser.add_argument("--backends", nargs="*", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--ivf-lists", type=int, default=0, help="mmap only: IVF lists (0 = exact search).")
+    parser.add_argument("--ivf-probe", type=int, default=8, help="mmap only: lists probed per query.")
+    parser.add_argument("--mmap-dtype", choices=["float16", "float32"], default="float16")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--child", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    parser.add_argument("--queries-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    sys.path.insert(0, PROJECT_DIR)
+    vectors, query_vectors = make_corpus(args.rows, args.dim, args.queries)
+    truth = exact_neighbours(vectors, query_vectors, args.k)
+
+    work_dir = tempfile.mkdtemp(prefix="vector-benchmark-")
+    try:
+        queries_file = os.path.join(work_dir, "queries.npy")
+        np.save(queries_file, query_vectors)
+
+        results = {}
+        print(f"rows={args.rows} dim={args.dim} queries={args.queries} k={args.k} ivf_lists={args.ivf_lists} mmap_dtype={args.mmap_dtype}")
+        print(f"{'backend':<10}{'build (s)':>10}{'open (s)':>10}{'1st query (s)':>15}{'p50 (ms)':>10}"
+              f"{'p95 (ms)':>10}{'recall':>8}{'private MB':>12}{'shared MB':>11}")
+        for backend in args.backends:
+            path = os.path.join(work_dir, backend)
+            build_seconds = build(backend, path, vectors, args.mmap_dtype)
+            run = measure(backend, path, queries_file, args)
+            recall = float(np.mean([len(set(found) & expected) / args.k for found, expected in zip(run.pop("results"), truth)]))
+            results[backend] = dict(run, build_seconds=build_seconds, recall=recall)
+
+            shared = "n/a" if run["shared_mb"] is None else f"{run['shared_mb']:.1f}"
+            print(f"{backend:<10}{build_seconds:>10.2f}{run['open_seconds']:>10.3f}{run['first_query_seconds']:>15.3f}"
+                  f"{run['p50_ms']:>10.2f}{run['p95_ms']:>10.2f}{recall:>8.3f}{run['private_mb']:>12.1f}{shared:>11}")
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"rows": args.rows, "dim": args.dim, "k": args.k, "ivf_lists": args.ivf_lists, "mmap_dtype": args.mmap_dtype, "backends": results}, f, indent=2)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
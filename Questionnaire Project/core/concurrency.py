@@ -0,0 +1,76 @@
+import os
+import asyncio
+import weakref
+import contextlib
+
+from core.metrics import registry
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 64))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 1024))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 30.0))
+
+
+class LLMCapacityError(Exception):
+    """Raised when an LLM call cannot be admitted within the queue limits."""
+
+
+class ConcurrencyLimiter:
+    """
+    Admission control for async LLM calls.
+
+    At most `max_concurrency` calls run at once. Up to `max_queue` further
+    callers wait for a slot, each for at most `queue_timeout` seconds; beyond
+    that, callers are rejected with LLMCapacityError instead of piling up.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.in_flight = 0
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        semaphore = self._semaphore()
+        if not semaphore.locked():
+            await semaphore.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                raise LLMCapacityError("LLM request queue is full, try again later.")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise LLMCapacityError(
+                    f"Timed out after {self.queue_timeout}s waiting for an LLM slot, try again later."
+                )
+            finally:
+                self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+
+
+llm_limiter = ConcurrencyLimiter(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
+
+registry.gauge("llm_limiter_in_flight", "LLM calls holding a limiter slot.").set_function(lambda: llm_limiter.in_flight)
+registry.gauge("llm_limiter_waiting", "LLM calls queued for a limiter slot.").set_function(lambda: llm_limiter.waiting)
+
+
+async def ainvoke_limited(llm, prompt):
+    """Runs `llm.ainvoke(prompt)` once the shared limiter admits it."""
+    async with llm_limiter.slot():
+        return await llm.ainvoke(prompt)
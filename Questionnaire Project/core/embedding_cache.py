@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from core.metrics import EMBEDDING_CACHE_LOOKUPS
+
+SQLITE_MAX_VARIABLES = 500
+
+
+def embedding_key(text: str, namespace: str) -> str:
+    return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Content-addressed on-disk store of float32 vectors, keyed by text hash."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: list) -> dict:
+        """Returns {key: vector} for the keys that are present, in batched lookups."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                batch = keys[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: dict):
+        rows = [
+            (key, len(vector), np.asarray(vector, dtype=np.float32).tobytes())
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embedding model wrapper that only sends texts it has never seen to the
+    wrapped model. Vectors are keyed by a hash of the text and the embedding
+    deployment, so a deployment change never returns stale vectors. A small
+    in-memory LRU keeps hot query and document vectors off disk entirely.
+    """
+
+    def __init__(self, embeddings, store: EmbeddingStore, namespace: str, max_memory_entries: int = 1024):
+        self.embeddings = embeddings
+        self.store = store
+        self.namespace = namespace
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, items: dict):
+        with self._lock:
+            for key, vector in items.items():
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, keys: list) -> dict:
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                else:
+                    missing.append(key)
+        if missing:
+            found.update(self.store.get_many(missing))
+        return found
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [embedding_key(text, self.namespace) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                pending.setdefault(key, text)
+        misses = sum(1 for key in keys if key not in found)
+        EMBEDDING_CACHE_LOOKUPS.inc(len(keys) - misses, result="hit")
+        EMBEDDING_CACHE_LOOKUPS.inc(misses, result="miss")
+        if pending:
+            vectors = self.embeddings.embed_documents(list(pending.values()))
+            computed = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(pending, vectors)}
+            self.store.put_many(computed)
+            found.update(computed)
+        self._remember({key: found[key] for key in dict.fromkeys(keys)})
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        key = embedding_key(text, self.namespace)
+        vector = self._lookup([key]).get(key)
+        EMBEDDING_CACHE_LOOKUPS.inc(result="miss" if vector is None else "hit")
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            self.store.put_many({key: vector})
+        self._remember({key: vector})
+        return vector.tolist()
@@ -0,0 +1,331 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from core.metrics import LLM_CACHE_LOOKUPS, current_stage
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt) -> str:
+    """
+    Renders a prompt (string, message list or prompt value) into the canonical
+    text used as the cache key. Whitespace runs are collapsed so that cosmetic
+    differences in template indentation do not defeat the cache.
+    """
+    if hasattr(prompt, "to_messages"):
+        prompt = prompt.to_messages()
+    if isinstance(prompt, str):
+        text = prompt
+    else:
+        parts = []
+        for message in prompt:
+            if isinstance(message, tuple):
+                role, content = message
+            elif isinstance(message, dict):
+                role, content = message.get("role", ""), message.get("content", "")
+            else:
+                role, content = message.type, message.content
+            parts.append(f"{role}: {content}")
+        text = "\n".join(parts)
+    return " ".join(text.split())
+
+
+def make_cache_key(text: str, namespace: str) -> str:
+    return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU store with TTL. Contents are lost on restart."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, entry: dict, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry["created_at"] > self.ttl_seconds
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry, now):
+                del self._entries[key]
+                self.version += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, entry: dict):
+        with self._lock:
+            self._entries[entry["key"]] = entry
+            self._entries.move_to_end(entry["key"])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.version += 1
+
+    def embedded_entries(self, namespace: str) -> list:
+        now = time.time()
+        with self._lock:
+            return [
+                (entry["key"], entry["embedding"])
+                for entry in self._entries.values()
+                if entry["namespace"] == namespace
+                and entry["embedding"] is not None
+                and not self._expired(entry, now)
+            ]
+
+
+class SQLiteCacheBackend:
+    """On-disk store with TTL and least-recently-accessed eviction, shared across processes."""
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._local_version = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, namespace TEXT NOT NULL, prompt TEXT NOT NULL,"
+            " response TEXT NOT NULL, embedding BLOB,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        self._conn.commit()
+
+    @property
+    def version(self) -> tuple:
+        """
+        Changes whenever an entry is written, by this process or by another
+        one sharing the file, whose inserts raise MAX(rowid). Rows removed
+        elsewhere do not change it, but a stale key only misses on `get`.
+        """
+        with self._lock:
+            max_rowid = self._conn.execute("SELECT MAX(rowid) FROM llm_cache").fetchone()[0]
+            return self._local_version, max_rowid or 0
+
+    def _cutoff(self, now: float) -> float:
+        return now - self.ttl_seconds if self.ttl_seconds > 0 else float("-inf")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, namespace, prompt, response, embedding, created_at FROM llm_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[5] < self._cutoff(now):
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self._local_version += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return {
+            "key": row[0],
+            "namespace": row[1],
+            "prompt": row[2],
+            "response": row[3],
+            "embedding": np.frombuffer(row[4], dtype=np.float32) if row[4] is not None else None,
+            "created_at": row[5],
+        }
+
+    def put(self, entry: dict):
+        embedding = entry["embedding"]
+        blob = embedding.astype(np.float32).tobytes() if embedding is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache"
+                " (key, namespace, prompt, response, embedding, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry["key"], entry["namespace"], entry["prompt"], entry["response"],
+                 blob, entry["created_at"], entry["created_at"]),
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (self._cutoff(time.time()),))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+            self._local_version += 1
+
+    def embedded_entries(self, namespace: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, embedding FROM llm_cache"
+                " WHERE namespace = ? AND embedding IS NOT NULL AND created_at >= ?",
+                (namespace, self._cutoff(time.time())),
+            ).fetchall()
+        return [(key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows]
+
+
+class LLMResponseCache:
+    """
+    Two-tier response cache.
+
+    The exact tier matches on the normalised prompt within a namespace (model
+    deployment + temperature). The optional semantic tier, enabled when an
+    embedding model and a threshold > 0 are given, returns the stored answer
+    of the most similar cached prompt if its cosine similarity reaches the
+    threshold.
+    """
+
+    def __init__(self, backend, embeddings=None, semantic_threshold: float = 0.0):
+        self.backend = backend
+        self.embeddings = embeddings
+        self.semantic_threshold = semantic_threshold
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.embeddings is not None and self.semantic_threshold > 0
+
+    def _semantic_matrix(self, namespace: str, dim: int):
+        cache_key = (namespace, dim)
+        with self._lock:
+            cached = self._matrices.get(cache_key)
+            if cached is not None and cached[0] == self.backend.version:
+                return cached[1], cached[2]
+        version = self.backend.version
+        entries = [(key, vector) for key, vector in self.backend.embedded_entries(namespace) if vector.shape[0] == dim]
+        keys = [key for key, _ in entries]
+        matrix = np.vstack([vector for _, vector in entries]) if entries else None
+        with self._lock:
+            self._matrices[cache_key] = (version, keys, matrix)
+        return keys, matrix
+
+    def lookup(self, prompt, namespace: str) -> tuple:
+        """
+        Returns (response or None, lookup state). The state must be passed
+        back to `store` on a miss so the prompt embedding is not recomputed.
+        """
+        text = normalize_prompt(prompt)
+        key = make_cache_key(text, namespace)
+        state = {"key": key, "text": text, "namespace": namespace, "embedding": None}
+
+        entry = self.backend.get(key)
+        if entry is not None:
+            LLM_CACHE_LOOKUPS.inc(stage=current_stage.get(), result="exact")
+            return entry["response"], state
+
+        if self.semantic_enabled:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            state["embedding"] = vector
+            keys, matrix = self._semantic_matrix(namespace, vector.shape[0])
+            if matrix is not None:
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.semantic_threshold:
+                    entry = self.backend.get(keys[best])
+                    if entry is not None:
+                        logger.debug("Semantic LLM cache hit (similarity %.4f)", scores[best])
+                        LLM_CACHE_LOOKUPS.inc(stage=current_stage.get(), result="semantic")
+                        return entry["response"], state
+        LLM_CACHE_LOOKUPS.inc(stage=current_stage.get(), result="miss")
+        return None, state
+
+    def store(self, state: dict, response: str):
+        self.backend.put({
+            "key": state["key"],
+            "namespace": state["namespace"],
+            "prompt": state["text"],
+            "response": response,
+            "embedding": state["embedding"],
+            "created_at": time.time(),
+        })
+
+
+class CachedChatModel:
+    """
+    Wraps a chat model so that `invoke`, `ainvoke`, `stream` and `astream`
+    are served from an LLMResponseCache; a cached answer is streamed as a
+    single chunk. Everything else is delegated to the wrapped model unchanged.
+    """
+
+    def __init__(self, llm, cache: LLMResponseCache, namespace: str):
+        self.llm = llm
+        self.cache = cache
+        self.namespace = namespace
+
+    def invoke(self, input, config=None, **kwargs):
+        if kwargs:
+            return self.llm.invoke(input, config=config, **kwargs)
+        cached, state = self.cache.lookup(input, self.namespace)
+        if cached is not None:
+            return AIMessage(content=cached, response_metadata={"cache_hit": True})
+        response = self.llm.invoke(input, config=config)
+        self.cache.store(state, response.content)
+        return response
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        if kwargs:
+            return await self.llm.ainvoke(input, config=config, **kwargs)
+        cached, state = await asyncio.to_thread(self.cache.lookup, input, self.namespace)
+        if cached is not None:
+            return AIMessage(content=cached, response_metadata={"cache_hit": True})
+        response = await self.llm.ainvoke(input, config=config)
+        await asyncio.to_thread(self.cache.store, state, response.content)
+        return response
+
+    def stream(self, input, config=None, **kwargs):
+        if kwargs:
+            yield from self.llm.stream(input, config=config, **kwargs)
+            return
+        cached, state = self.cache.lookup(input, self.namespace)
+        if cached is not None:
+            yield AIMessageChunk(content=cached, response_metadata={"cache_hit": True})
+            return
+        parts = []
+        for chunk in self.llm.stream(input, config=config):
+            parts.append(chunk.content)
+            yield chunk
+        self.cache.store(state, "".join(parts))
+
+    async def astream(self, input, config=None, **kwargs):
+        if kwargs:
+            async for chunk in self.llm.astream(input, config=config, **kwargs):
+                yield chunk
+            return
+        cached, state = await asyncio.to_thread(self.cache.lookup, input, self.namespace)
+        if cached is not None:
+            yield AIMessageChunk(content=cached, response_metadata={"cache_hit": True})
+            return
+        parts = []
+        async for chunk in self.llm.astream(input, config=config):
+            parts.append(chunk.content)
+            yield chunk
+        await asyncio.to_thread(self.cache.store, state, "".join(parts))
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+def uncached(llm):
+    """Returns the model underneath a CachedChatModel, or `llm` itself."""
+    return llm.llm if isinstance(llm, CachedChatModel) else llm
+
+
+def build_namespace(deployment: str, temperature: float) -> str:
+    return json.dumps({"deployment": deployment, "temperature": temperature}, sort_keys=True)
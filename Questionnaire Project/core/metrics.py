@@ -0,0 +1,350 @@
+import time
+import bisect
+import inspect
+import threading
+import functools
+import contextvars
+import contextlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Pipeline stage the current call belongs to; LLM token and cache metrics are
+# attributed to it. asyncio tasks and asyncio.to_thread inherit it.
+current_stage = contextvars.ContextVar("current_stage", default="other")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, "", value) for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Reads the (unlabelled) value from `function` at scrape time."""
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            return [(self.name, (), "", self._function())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key, f'le="{_format_value(bound)}"', cumulative))
+                samples.append((f"{self.name}_sum", key, "", series["sum"]))
+                samples.append((f"{self.name}_count", key, "", series["count"]))
+        return samples
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_DURATION = registry.histogram("pipeline_stage_duration_seconds", "Wall time of pipeline functions.", ("stage",))
+STAGE_IN_FLIGHT = registry.gauge("pipeline_stage_in_flight", "Pipeline function calls currently running.", ("stage",))
+STAGE_ERRORS = registry.counter("pipeline_stage_errors_total", "Pipeline function calls that raised.", ("stage",))
+
+LLM_REQUESTS = registry.counter("llm_requests_total", "Calls that reached the LLM (cache misses).", ("stage",))
+LLM_DURATION = registry.histogram("llm_request_duration_seconds", "Latency of calls that reached the LLM.", ("stage",))
+LLM_PROMPT_TOKENS = registry.counter("llm_prompt_tokens_total", "Prompt tokens billed by the LLM.", ("stage",))
+LLM_COMPLETION_TOKENS = registry.counter("llm_completion_tokens_total", "Completion tokens billed by the LLM.", ("stage",))
+LLM_CACHED_PROMPT_TOKENS = registry.counter(
+    "llm_cached_prompt_tokens_total", "Prompt tokens served from the provider's prompt cache.", ("stage",)
+)
+LLM_TIME_TO_FIRST_TOKEN = registry.histogram(
+    "llm_time_to_first_token_seconds", "Latency until the first streamed chunk of a call that reached the LLM.", ("stage",)
+)
+LLM_CACHE_LOOKUPS = registry.counter("llm_cache_lookups_total", "LLM response cache lookups by outcome (exact, semantic, miss).", ("stage", "result"))
+EMBEDDING_CACHE_LOOKUPS = registry.counter("embedding_cache_lookups_total", "Embedding cache lookups per text by outcome (hit, miss).", ("result",))
+
+RETRIEVAL_DURATION = registry.histogram("retrieval_duration_seconds", "Vector retrieval latency.", ("method",))
+RETRIEVAL_CHUNKS = registry.histogram(
+    "retrieval_chunks", "Chunks returned per retrieval query.", ("method",), buckets=(0, 1, 2, 4, 8, 16, 32, 64)
+)
+
+
+def instrument(stage: str):
+    """
+    Decorator that records latency, in-flight count and errors of a pipeline
+    function under `stage`, and makes `stage` the current stage for the LLM
+    calls it makes. Works on sync functions, coroutines and async generators.
+    Cancellation (CancelledError, GeneratorExit from a client disconnect) is
+    not counted as an error.
+    """
+    def decorator(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def agen_wrapper(*args, **kwargs):
+                # The stage is set only while the inner generator runs: between
+                # items control is back with the consumer, whose context must not
+                # see it, and the wrapper may be finalised from another context.
+                agen = fn(*args, **kwargs)
+                STAGE_IN_FLIGHT.inc(stage=stage)
+                start = time.perf_counter()
+                try:
+                    while True:
+                        token = current_stage.set(stage)
+                        try:
+                            item = await agen.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            current_stage.reset(token)
+                        yield item
+                except Exception:
+                    STAGE_ERRORS.inc(stage=stage)
+                    raise
+                finally:
+                    STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+                    STAGE_IN_FLIGHT.dec(stage=stage)
+                    token = current_stage.set(stage)
+                    try:
+                        await agen.aclose()
+                    finally:
+                        current_stage.reset(token)
+            return agen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                token = current_stage.set(stage)
+                STAGE_IN_FLIGHT.inc(stage=stage)
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    STAGE_ERRORS.inc(stage=stage)
+                    raise
+                finally:
+                    STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+                    STAGE_IN_FLIGHT.dec(stage=stage)
+                    current_stage.reset(token)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = current_stage.set(stage)
+            STAGE_IN_FLIGHT.inc(stage=stage)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                STAGE_ERRORS.inc(stage=stage)
+                raise
+            finally:
+                STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+                STAGE_IN_FLIGHT.dec(stage=stage)
+                current_stage.reset(token)
+        return wrapper
+
+    return decorator
+
+
+def record_llm_usage(message):
+    """
+    Adds the token usage reported on a response or stream chunk to the current
+    stage, including the prompt tokens the provider served from its prompt cache.
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        stage = current_stage.get()
+        input_tokens = usage.get("input_tokens", 0)
+        cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+        LLM_PROMPT_TOKENS.inc(input_tokens, stage=stage)
+        LLM_COMPLETION_TOKENS.inc(usage.get("output_tokens", 0), stage=stage)
+        LLM_CACHED_PROMPT_TOKENS.inc(cached_tokens, stage=stage)
+        logger.debug("LLM call in %s: %d prompt tokens, %d cached", stage, input_tokens, cached_tokens)
+
+
+def record_retrieval(method: str, seconds: float, chunk_counts):
+    RETRIEVAL_DURATION.observe(seconds, method=method)
+    for count in chunk_counts:
+        RETRIEVAL_CHUNKS.observe(count, method=method)
+
+
+class MeteredChatModel:
+    """
+    Wraps a chat model to record request count, latency and token usage of
+    every call against the current stage. Sits underneath CachedChatModel,
+    so only calls that actually reach the model are counted.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def invoke(self, input, config=None, **kwargs):
+        stage = current_stage.get()
+        LLM_REQUESTS.inc(stage=stage)
+        with LLM_DURATION.time(stage=stage):
+            response = self.llm.invoke(input, config=config, **kwargs)
+        record_llm_usage(response)
+        return response
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        stage = current_stage.get()
+        LLM_REQUESTS.inc(stage=stage)
+        with LLM_DURATION.time(stage=stage):
+            response = await self.llm.ainvoke(input, config=config, **kwargs)
+        record_llm_usage(response)
+        return response
+
+    def stream(self, input, config=None, **kwargs):
+        stage = current_stage.get()
+        LLM_REQUESTS.inc(stage=stage)
+        start = time.perf_counter()
+        first = True
+        with LLM_DURATION.time(stage=stage):
+            for chunk in self.llm.stream(input, config=config, **kwargs):
+                if first:
+                    LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - start, stage=stage)
+                    first = False
+                record_llm_usage(chunk)
+                yield chunk
+
+    async def astream(self, input, config=None, **kwargs):
+        stage = current_stage.get()
+        LLM_REQUESTS.inc(stage=stage)
+        start = time.perf_counter()
+        first = True
+        with LLM_DURATION.time(stage=stage):
+            async for chunk in self.llm.astream(input, config=config, **kwargs):
+                if first:
+                    LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - start, stage=stage)
+                    first = False
+                record_llm_usage(chunk)
+                yield chunk
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
@@ -1,8 +1,8 @@
 import os
 import logging
+import threading
 import traceback
 from dotenv import load_dotenv
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 
 load_dotenv(dotenv_path=".env", override=True)
 
@@ -15,9 +15,129 @@ AZURE_DEPLOYMENT = os.getenv("AZURE_DEPLOYMENT")
 AZURE_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_EMBEDDING")
 TEMPERATURE = float(os.getenv("TEMPERATURE", 0.0))
 
+# LLM response cache: exact-match tier always on when enabled, semantic tier
+# only when LLM_SEMANTIC_CACHE_THRESHOLD > 0 (e.g. 0.97).
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "sqlite")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join("cache", "llm_cache.sqlite3"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+LLM_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", 0.0))
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("cache", "embeddings.sqlite3"))
+
+# Model backends: "azure" (default), "fake" / "hash" for offline deterministic
+# stand-ins, "record" to call Azure and save every response to RECORDINGS_PATH,
+# "replay" to serve saved responses only.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "azure")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hash" if LLM_BACKEND == "fake" else LLM_BACKEND)
+RECORDINGS_PATH = os.getenv("RECORDINGS_PATH", os.path.join("cache", "recordings.sqlite3"))
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", 0.0))
+FAKE_LLM_TOKEN_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_TOKEN_LATENCY_SECONDS", 0.0))
+FAKE_LLM_RESPONSE_WORDS = int(os.getenv("FAKE_LLM_RESPONSE_WORDS", 60))
+FAKE_EMBEDDING_DIM = int(os.getenv("FAKE_EMBEDDING_DIM", 256))
+FAKE_EMBEDDING_LATENCY_SECONDS = float(os.getenv("FAKE_EMBEDDING_LATENCY_SECONDS", 0.0))
+
+# Upstream call policy: transient errors (429, 5xx, timeouts) are retried with
+# exponential backoff and jitter; *_PER_MINUTE > 0 enables a client-side token
+# bucket per deployment; identical in-flight calls are coalesced into one.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 30.0))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 0))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", 0))
+EMBEDDING_REQUESTS_PER_MINUTE = float(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", 0))
+EMBEDDING_TOKENS_PER_MINUTE = float(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", 0))
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# Identity of the models actually answering, used to namespace caches and
+# indexes so fake and real outputs never mix.
+LLM_MODEL_NAME = "fake" if LLM_BACKEND == "fake" else AZURE_DEPLOYMENT
+EMBEDDING_MODEL_NAME = f"hash-{FAKE_EMBEDDING_DIM}" if EMBEDDING_BACKEND == "hash" else AZURE_EMBEDDING_DEPLOYMENT
+
+
+class LazyModel:
+    """
+    Proxy that builds the wrapped model on first use.
+
+    Importing this module stays cheap (no langchain_openai import, no client
+    construction); the first attribute access constructs the model once,
+    thread-safely, and every later access is delegated to it. `isinstance`
+    checks see the wrapped model's class.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def resolve(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    object.__setattr__(self, "_instance", self._factory())
+        return self._instance
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    @property
+    def __class__(self):
+        return type(self.resolve())
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
 
 class Model:
     def llm(self):
+        if LLM_BACKEND == "fake":
+            from core.offline import FakeChatModel
+
+            return FakeChatModel(
+                latency=FAKE_LLM_LATENCY_SECONDS,
+                token_latency=FAKE_LLM_TOKEN_LATENCY_SECONDS,
+                response_words=FAKE_LLM_RESPONSE_WORDS,
+            )
+        if LLM_BACKEND in ("record", "replay"):
+            from core.offline import RecordReplayChatModel, RecordingStore
+
+            return RecordReplayChatModel(
+                llm=self.azure_llm() if LLM_BACKEND == "record" else None,
+                store=RecordingStore(RECORDINGS_PATH),
+                mode=LLM_BACKEND,
+                namespace=f"{AZURE_DEPLOYMENT}:{TEMPERATURE}",
+            )
+        if LLM_BACKEND != "azure":
+            raise ValueError(f"Unknown LLM_BACKEND: {LLM_BACKEND}")
+        return self.azure_llm()
+
+    def embedding(self):
+        if EMBEDDING_BACKEND == "hash":
+            from core.offline import HashEmbeddings
+
+            return HashEmbeddings(FAKE_EMBEDDING_DIM, latency=FAKE_EMBEDDING_LATENCY_SECONDS)
+        if EMBEDDING_BACKEND in ("record", "replay"):
+            from core.offline import RecordReplayEmbeddings, RecordingStore
+
+            return RecordReplayEmbeddings(
+                self.azure_embedding() if EMBEDDING_BACKEND == "record" else None,
+                RecordingStore(RECORDINGS_PATH),
+                mode=EMBEDDING_BACKEND,
+                namespace=AZURE_EMBEDDING_DEPLOYMENT or "",
+            )
+        if EMBEDDING_BACKEND != "azure":
+            raise ValueError(f"Unknown EMBEDDING_BACKEND: {EMBEDDING_BACKEND}")
+        return self.azure_embedding()
+
+    def azure_llm(self):
+        from langchain_openai import AzureChatOpenAI
+
         try:
             return AzureChatOpenAI(
                 azure_endpoint=AZUREOPENAI_ENDPOINT,
@@ -25,25 +145,97 @@ class Model:
                 model=AZURE_DEPLOYMENT,
                 api_version=API_VERSION,
                 temperature=TEMPERATURE,
-                streaming=True
-
-                
+                streaming=True,
+                stream_usage=True,
+                max_retries=0  # retried by ResilientChatModel
             )
         except Exception as e:
             raise Exception(f"LLM Init Error: {e}\n{traceback.format_exc()}")
 
-    def embedding(self):
+    def azure_embedding(self):
+        from langchain_openai import AzureOpenAIEmbeddings
+
         try:
             return AzureOpenAIEmbeddings(
                 azure_endpoint=AZUREOPENAI_ENDPOINT,
                 api_key=AZUREOPENAI_API_KEY,
                 azure_deployment=AZURE_EMBEDDING_DEPLOYMENT,
-                api_version=API_VERSION
+                api_version=API_VERSION,
+                max_retries=0  # retried by ResilientEmbeddings
             )
         except Exception as e:
             raise Exception(f"Embedding Init Error: {e}\n{traceback.format_exc()}")
 
+    def cached_embedding(self, embeddings):
+        if not EMBEDDING_CACHE_ENABLED:
+            return embeddings
+        from core.embedding_cache import CachedEmbeddings, EmbeddingStore
+
+        return CachedEmbeddings(embeddings, EmbeddingStore(EMBEDDING_CACHE_PATH), EMBEDDING_MODEL_NAME or "")
+
+    def retry_policy(self):
+        from core.resilience import RetryPolicy
+
+        return RetryPolicy(LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY)
+
+    def resilient_llm(self, llm):
+        from core.resilience import ResilientChatModel, deployment_buckets
+
+        return ResilientChatModel(
+            llm,
+            self.retry_policy(),
+            deployment_buckets(LLM_MODEL_NAME or "", LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE),
+            namespace=f"{LLM_MODEL_NAME}:{TEMPERATURE}",
+            single_flight=SINGLE_FLIGHT_ENABLED,
+        )
+
+    def resilient_embedding(self, embeddings):
+        from core.resilience import ResilientEmbeddings, deployment_buckets
+
+        return ResilientEmbeddings(
+            embeddings,
+            self.retry_policy(),
+            deployment_buckets(EMBEDDING_MODEL_NAME or "", EMBEDDING_REQUESTS_PER_MINUTE, EMBEDDING_TOKENS_PER_MINUTE),
+            namespace=EMBEDDING_MODEL_NAME or "",
+            single_flight=SINGLE_FLIGHT_ENABLED,
+        )
+
+    def metered_llm(self, llm):
+        from core.metrics import MeteredChatModel
+
+        return MeteredChatModel(llm)
+
+    def cached_llm(self, llm, embeddings=None):
+        if not LLM_CACHE_ENABLED:
+            return llm
+        from core.llm_cache import (
+            CachedChatModel,
+            LLMResponseCache,
+            MemoryCacheBackend,
+            SQLiteCacheBackend,
+            build_namespace,
+        )
+
+        if LLM_CACHE_BACKEND == "memory":
+            backend = MemoryCacheBackend(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS)
+        else:
+            backend = SQLiteCacheBackend(LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS)
+        cache = LLMResponseCache(
+            backend,
+            embeddings=embeddings,
+            semantic_threshold=LLM_SEMANTIC_CACHE_THRESHOLD,
+        )
+        return CachedChatModel(llm, cache, build_namespace(LLM_MODEL_NAME, TEMPERATURE))
+
 
 mode_instance = Model()
-llm_instance = mode_instance.llm()
-embeddings_instance = mode_instance.embedding()
+embeddings_instance = LazyModel(
+    lambda: mode_instance.cached_embedding(mode_instance.resilient_embedding(mode_instance.embedding()))
+)
+# Cache first, then coalescing/retries, then metering, so every attempt that
+# reaches the deployment is counted once and cache hits never queue for it.
+llm_instance = LazyModel(
+    lambda: mode_instance.cached_llm(
+        mode_instance.resilient_llm(mode_instance.metered_llm(mode_instance.llm())), embeddings_instance
+    )
+)
@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from core.llm_cache import make_cache_key, normalize_prompt
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Azure chat model.
+
+    The response is derived from a hash of the prompt, so the same prompt always
+    yields the same text. Prompts asking for the batched follow-up JSON get a
+    well-formed {"followups": [...]} object; everything else gets a bullet list
+    of roughly `response_words` words. `latency` is added per call and
+    `token_latency` per streamed word to approximate a real deployment.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    response_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, messages) -> str:
+        text = normalize_prompt(messages)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if '"followups"' in text:
+            return json.dumps({"followups": [
+                f"Follow-up question {digest[:6]}-{i}: how is this handled today?" for i in range(1, 3)
+            ]})
+
+        vocabulary = sorted(set(_WORD_RE.findall(text.lower()))) or ["sourcing"]
+        rng = np.random.default_rng(int(digest[:16], 16))
+        lines, words = [], 0
+        while words < self.response_words:
+            picked = rng.choice(vocabulary, size=min(8, self.response_words - words))
+            lines.append("- " + " ".join(picked).capitalize() + ".")
+            words += len(picked)
+        return "\n".join(lines)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        content = self._respond(messages)
+        if self.token_latency:
+            time.sleep(self.token_latency * len(content.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self._respond(messages)
+        if self.token_latency:
+            await asyncio.sleep(self.token_latency * len(content.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        for token in re.split(r"(?<=\s)", self._respond(messages)):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for token in re.split(r"(?<=\s)", self._respond(messages)):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Feature-hashed bag-of-words embeddings: each word is hashed into one of
+    `dimensions` buckets and the vector is L2-normalised. Texts that share
+    words are close, so retrieval still behaves sensibly without a network.
+    """
+
+    def __init__(self, dimensions: int = 256, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in _WORD_RE.findall(text.lower()):
+            bucket = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[bucket % self.dimensions] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+
+class RecordingStore:
+    """SQLite file of recorded model responses, keyed by prompt/text hash."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recordings (key TEXT PRIMARY KEY, payload TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM recordings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, payload):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recordings (key, payload) VALUES (?, ?)", (key, json.dumps(payload))
+            )
+            self._conn.commit()
+
+
+class RecordingMissError(KeyError):
+    """Raised in replay mode when a prompt or text was never recorded."""
+
+
+class RecordReplayChatModel(BaseChatModel):
+    """
+    In "record" mode every call goes to `llm` and the response text is saved
+    to `store`; in "replay" mode responses are served from `store` only and a
+    prompt that was never recorded raises RecordingMissError.
+    """
+
+    llm: Optional[Any] = None
+    store: Any
+    mode: str = "replay"
+    namespace: str = ""
+
+    @property
+    def _llm_type(self) -> str:
+        return f"{self.mode}-chat"
+
+    def _key(self, messages) -> str:
+        return make_cache_key(normalize_prompt(messages), "chat\0" + self.namespace)
+
+    def _replay(self, key: str) -> ChatResult:
+        content = self.store.get(key)
+        if content is None:
+            raise RecordingMissError(f"No recorded response for prompt {key[:12]}; record it with LLM_BACKEND=record.")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = self._key(messages)
+        if self.mode == "replay":
+            return self._replay(key)
+        content = self.llm.invoke(messages).content
+        self.store.put(key, content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = self._key(messages)
+        if self.mode == "replay":
+            return self._replay(key)
+        content = (await self.llm.ainvoke(messages)).content
+        await asyncio.to_thread(self.store.put, key, content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+class RecordReplayEmbeddings(Embeddings):
+    """Embeddings counterpart of RecordReplayChatModel; misses are embedded in one batch when recording."""
+
+    def __init__(self, embeddings, store: RecordingStore, mode: str = "replay", namespace: str = ""):
+        self.embeddings = embeddings
+        self.store = store
+        self.mode = mode
+        self.namespace = namespace
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [make_cache_key(text, "embedding\0" + self.namespace) for text in texts]
+        vectors = [self.store.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing and self.mode == "replay":
+            raise RecordingMissError(
+                f"{len(missing)} texts were never embedded while recording; record them with EMBEDDING_BACKEND=record."
+            )
+        if missing:
+            fresh = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, fresh):
+                self.store.put(keys[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,338 @@
+import time
+import random
+import asyncio
+import logging
+import weakref
+import threading
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+from core.llm_cache import make_cache_key, normalize_prompt
+from core.metrics import registry, current_stage
+
+logger = logging.getLogger(__name__)
+
+LLM_RETRIES = registry.counter("llm_retries_total", "Upstream calls retried after a transient error.", ("stage", "reason"))
+LLM_COALESCED = registry.counter("llm_coalesced_calls_total", "Calls that joined an identical in-flight call.", ("stage",))
+RATE_LIMIT_WAIT = registry.histogram(
+    "llm_rate_limit_wait_seconds", "Time spent waiting on the client-side token bucket.", ("bucket",)
+)
+
+_RETRYABLE_NAMES = {"APITimeoutError", "APIConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout", "ConnectError"}
+
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def retry_reason(exc):
+    """Why `exc` is worth retrying ("throttled", "server_error", "timeout", "connection"), or None."""
+    status = _status_code(exc)
+    if status == 429:
+        return "throttled"
+    if isinstance(status, int) and (status >= 500 or status == 408):
+        return "server_error"
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(exc, ConnectionError) or type(exc).__name__ in _RETRYABLE_NAMES:
+        return "connection"
+    return None
+
+
+def retry_after(exc):
+    """Delay in seconds the server asked for via Retry-After / retry-after-ms, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: attempt n sleeps a random time in
+    [0, min(max_delay, base_delay * 2**n)]. A Retry-After header from a 429
+    is honoured as a lower bound. Only transient errors are retried.
+    """
+
+    def __init__(self, max_retries: int = 5, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, exc) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after(exc)
+        if requested is not None:
+            return min(self.max_delay, max(backoff, requested))
+        return backoff
+
+    def should_retry(self, attempt: int, exc) -> bool:
+        reason = retry_reason(exc)
+        if reason is None or attempt >= self.max_retries:
+            return False
+        LLM_RETRIES.inc(stage=current_stage.get(), reason=reason)
+        logger.warning("Retrying upstream call (attempt %d/%d) after %s: %s", attempt + 1, self.max_retries, reason, exc)
+        return True
+
+    def call(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not self.should_retry(attempt, e):
+                    raise
+                time.sleep(self.delay(attempt, e))
+                attempt += 1
+
+    async def acall(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if not self.should_retry(attempt, e):
+                    raise
+                await asyncio.sleep(self.delay(attempt, e))
+                attempt += 1
+
+
+class TokenBucket:
+    """
+    Client-side rate limit of `rate_per_minute` units (requests or estimated
+    tokens) with bursts up to one minute's worth. Callers reserve their cost
+    up front and the balance may go negative; each caller then waits until
+    its reservation is covered, so waiters are served in arrival order.
+    """
+
+    def __init__(self, name: str, rate_per_minute: float):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, cost: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= cost
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, cost: float = 1.0):
+        wait = self._reserve(cost)
+        RATE_LIMIT_WAIT.observe(wait, bucket=self.name)
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self, cost: float = 1.0):
+        wait = self._reserve(cost)
+        RATE_LIMIT_WAIT.observe(wait, bucket=self.name)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def deployment_buckets(deployment: str, requests_per_minute: float, tokens_per_minute: float) -> list:
+    """Shared request and token buckets of one deployment; a rate of 0 disables that bucket."""
+    buckets = []
+    with _buckets_lock:
+        for unit, rate in (("requests", requests_per_minute), ("tokens", tokens_per_minute)):
+            if rate > 0:
+                name = f"{deployment}:{unit}"
+                if name not in _buckets:
+                    _buckets[name] = TokenBucket(name, rate)
+                buckets.append(_buckets[name])
+    return buckets
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English prose; good enough for pacing.
+    return max(1, len(text) // 4)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller
+    runs the work, later callers wait for and share its result or exception.
+    Nothing is remembered once the call finishes; that is the cache's job.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._tasks = weakref.WeakKeyDictionary()
+
+    def do(self, key: str, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            LLM_COALESCED.inc(stage=current_stage.get())
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    async def ado(self, key: str, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        tasks = self._tasks.setdefault(loop, {})
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda _: tasks.pop(key, None))
+        else:
+            LLM_COALESCED.inc(stage=current_stage.get())
+        # Shielded, so one caller going away does not cancel the call for the others.
+        return await asyncio.shield(task)
+
+
+class ResilientChatModel:
+    """
+    Wraps a chat model with the call-execution policy for the upstream
+    deployment: identical in-flight prompts share one call (invoke/ainvoke),
+    every upstream call first passes the deployment's token buckets, and
+    transient failures (429, 5xx, timeouts) are retried with backoff.
+    A stream is only retried while it has not yielded anything yet.
+    """
+
+    def __init__(self, llm, policy: RetryPolicy, buckets: list = (), namespace: str = "", single_flight: bool = True):
+        self.llm = llm
+        self.policy = policy
+        self.buckets = list(buckets)
+        self.namespace = namespace
+        self.single_flight = SingleFlight() if single_flight else None
+
+    def _key(self, input, kwargs) -> str:
+        return make_cache_key(normalize_prompt(input) + repr(sorted(kwargs.items())), self.namespace)
+
+    def _cost(self, bucket: TokenBucket, input) -> float:
+        return estimate_tokens(normalize_prompt(input)) if bucket.name.endswith(":tokens") else 1.0
+
+    def _throttle(self, input):
+        for bucket in self.buckets:
+            bucket.acquire(self._cost(bucket, input))
+
+    async def _athrottle(self, input):
+        for bucket in self.buckets:
+            await bucket.aacquire(self._cost(bucket, input))
+
+    def _invoke_once(self, input, config, kwargs):
+        self._throttle(input)
+        return self.llm.invoke(input, config=config, **kwargs)
+
+    async def _ainvoke_once(self, input, config, kwargs):
+        await self._athrottle(input)
+        return await self.llm.ainvoke(input, config=config, **kwargs)
+
+    def invoke(self, input, config=None, **kwargs):
+        call = lambda: self.policy.call(self._invoke_once, input, config, kwargs)
+        if self.single_flight is None:
+            return call()
+        return self.single_flight.do(self._key(input, kwargs), call)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        call = lambda: self.policy.acall(self._ainvoke_once, input, config, kwargs)
+        if self.single_flight is None:
+            return await call()
+        return await self.single_flight.ado(self._key(input, kwargs), call)
+
+    def stream(self, input, config=None, **kwargs):
+        attempt = 0
+        while True:
+            started = False
+            try:
+                self._throttle(input)
+                for chunk in self.llm.stream(input, config=config, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not self.policy.should_retry(attempt, e):
+                    raise
+                time.sleep(self.policy.delay(attempt, e))
+                attempt += 1
+
+    async def astream(self, input, config=None, **kwargs):
+        attempt = 0
+        while True:
+            started = False
+            try:
+                await self._athrottle(input)
+                async for chunk in self.llm.astream(input, config=config, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not self.policy.should_retry(attempt, e):
+                    raise
+                await asyncio.sleep(self.policy.delay(attempt, e))
+                attempt += 1
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+class ResilientEmbeddings(Embeddings):
+    """Embeddings counterpart of ResilientChatModel; concurrent identical requests share one call."""
+
+    def __init__(self, embeddings, policy: RetryPolicy, buckets: list = (), namespace: str = "", single_flight: bool = True):
+        self.embeddings = embeddings
+        self.policy = policy
+        self.buckets = list(buckets)
+        self.namespace = namespace
+        self.single_flight = SingleFlight() if single_flight else None
+
+    def _throttle(self, texts: list):
+        for bucket in self.buckets:
+            bucket.acquire(sum(estimate_tokens(t) for t in texts) if bucket.name.endswith(":tokens") else 1.0)
+
+    def _call(self, method: str, texts: list, arg):
+        def once():
+            self._throttle(texts)
+            return getattr(self.embeddings, method)(arg)
+
+        call = lambda: self.policy.call(once)
+        if self.single_flight is None:
+            return call()
+        return self.single_flight.do(make_cache_key("\0".join(texts), f"{method}\0{self.namespace}"), call)
+
+    def embed_documents(self, texts: list) -> list:
+        return self._call("embed_documents", texts, texts)
+
+    def embed_query(self, text: str) -> list:
+        return self._call("embed_query", [text], text)
+
+    async def aembed_documents(self, texts: list) -> list:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> list:
+        return await asyncio.to_thread(self.embed_query, text)
+
+    def __getattr__(self, name):
+        return getattr(self.embeddings, name)
@@ -0,0 +1,306 @@
+import os
+import copy
+import json
+import time
+import sqlite3
+import logging
+import threading
+import contextlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join("cache", "sessions.sqlite3"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", 1000))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 3600))
+SESSION_RETENTION_SECONDS = float(os.getenv("SESSION_RETENTION_SECONDS", 30 * 24 * 3600))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", 1.0))
+SESSION_REVALIDATE_SECONDS = float(os.getenv("SESSION_REVALIDATE_SECONDS", 2.0))
+SESSION_APPEND_ONLY_KEYS = ("history",)
+
+
+class SessionStore:
+    """
+    Session-scoped state (history, user choices, cached summaries) keyed by session ID.
+
+    Reads are served from an in-memory LRU of at most `max_sessions` entries;
+    entries idle for longer than `ttl_seconds` are dropped from memory. Writes
+    mark the entry dirty and a background thread flushes dirty entries to
+    SQLite every `flush_interval` seconds (write-behind). A clean entry that
+    was last checked more than `revalidate_seconds` ago is compared against
+    the row version in SQLite, so several worker processes sharing the file
+    pick up each other's writes.
+
+    Flushes are compare-and-swap on the row version. If another process
+    wrote the session since this one loaded it, the stored state is
+    reloaded and merged key by key: keys only this process changed take
+    its value, keys only the other process changed keep theirs, and keys
+    both changed are logged as a conflict and take this process's value.
+    Keys in `append_only_keys` (the Q&A history) are lists that both sides
+    only append to, so they are merged entry by entry instead: the result
+    keeps what either side appended, including follow-ups added to the same
+    entry, and only a rewrite of existing entries is treated as a conflict.
+
+    A delete leaves a tombstone until every flush that started before it has
+    finished, so a flush already in flight cannot write the session back.
+    """
+
+    def __init__(self, path: str, default_factory, max_sessions: int = SESSION_MAX_ENTRIES,
+                 ttl_seconds: float = SESSION_TTL_SECONDS, retention_seconds: float = SESSION_RETENTION_SECONDS,
+                 flush_interval: float = SESSION_FLUSH_INTERVAL, revalidate_seconds: float = SESSION_REVALIDATE_SECONDS,
+                 append_only_keys: tuple = SESSION_APPEND_ONLY_KEYS):
+        self.default_factory = default_factory
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.retention_seconds = retention_seconds
+        self.flush_interval = flush_interval
+        self.revalidate_seconds = revalidate_seconds
+        self.append_only_keys = tuple(append_only_keys)
+
+        self._entries = OrderedDict()
+        self._dirty = set()
+        self._deletions = 0
+        self._deleted = {}
+        self._flushing = 0
+        self._lock = threading.RLock()
+        self._db_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, state TEXT NOT NULL,"
+            " version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+        self._flusher.start()
+
+    # --- persistence -------------------------------------------------------
+
+    def _read_row(self, session_id: str):
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT state, version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+
+    def _read_version(self, session_id: str):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def _merge_appends(cls, base: list, local: list, stored: list):
+        """
+        Merges two lists that both grew from `base` by appending: entries only
+        one side changed take that side's version, list-valued fields of an
+        entry both changed (e.g. its follow-ups) are merged the same way, and
+        both sides' new entries follow, the stored ones first. Returns None
+        when either side rewrote or removed an existing entry.
+        """
+        if not all(isinstance(value, list) for value in (base, local, stored)):
+            return None
+        if len(local) < len(base) or len(stored) < len(base):
+            return None
+        merged = []
+        for old, mine, theirs in zip(base, local, stored):
+            if mine == old or mine == theirs:
+                merged.append(theirs)
+            elif theirs == old:
+                merged.append(mine)
+            elif isinstance(old, dict) and isinstance(mine, dict) and isinstance(theirs, dict):
+                entry = dict(theirs)
+                for field in set(old) | set(mine):
+                    if mine.get(field) == old.get(field) or mine.get(field) == theirs.get(field):
+                        continue
+                    if theirs.get(field) == old.get(field):
+                        entry[field] = mine[field]
+                        continue
+                    appended = cls._merge_appends(old.get(field), mine.get(field), theirs.get(field))
+                    if appended is None:
+                        return None
+                    entry[field] = appended
+                merged.append(entry)
+            else:
+                return None
+        return merged + stored[len(base):] + local[len(base):]
+
+    def _merge(self, session_id: str, base: dict, local: dict, stored: dict) -> dict:
+        """Three-way merge of top-level keys; `base` is the state both sides started from."""
+        merged = dict(stored)
+        for key in set(base) | set(local):
+            if local.get(key) == base.get(key):
+                continue
+            if stored.get(key) not in (base.get(key), local.get(key)):
+                if key in self.append_only_keys:
+                    appended = self._merge_appends(base.get(key, []), local.get(key), stored.get(key, []))
+                    if appended is not None:
+                        merged[key] = appended
+                        continue
+                logger.warning("Session %s: concurrent writes to %r, keeping this worker's value", session_id, key)
+            if key in local:
+                merged[key] = local[key]
+            else:
+                merged.pop(key, None)
+        return merged
+
+    def _write_row(self, session_id: str, state: str, base: str, version: int) -> tuple:
+        """Compare-and-swap write of one session; returns the (state, version) that was stored."""
+        while True:
+            now = time.time()
+            updated = self._conn.execute(
+                "UPDATE sessions SET state = ?, version = ?, updated_at = ? WHERE session_id = ? AND version = ?",
+                (state, version + 1, now, session_id, version),
+            ).rowcount
+            if updated:
+                return state, version + 1
+            row = self._conn.execute(
+                "SELECT state, version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, state, version, updated_at) VALUES (?, ?, ?, ?)",
+                    (session_id, state, version + 1, now),
+                ).rowcount
+                if inserted:
+                    return state, version + 1
+                continue
+            state = json.dumps(self._merge(session_id, json.loads(base), json.loads(state), json.loads(row[0])))
+            base, version = row
+
+    def flush(self):
+        """Writes every dirty session to SQLite."""
+        with self._lock:
+            pending = []
+            for session_id in self._dirty:
+                entry = self._entries.get(session_id)
+                if entry is not None:
+                    pending.append((session_id, json.dumps(entry["state"]), entry["base"], entry["version"]))
+            self._dirty.clear()
+            if not pending:
+                return
+            generation = self._deletions
+            self._flushing += 1
+        try:
+            self._flush_pending(pending, generation)
+        finally:
+            with self._lock:
+                self._flushing -= 1
+                if not self._flushing:
+                    self._deleted.clear()
+
+    def _flush_pending(self, pending: list, generation: int):
+        written = []
+        try:
+            with self._db_lock:
+                try:
+                    for session_id, state, base, version in pending:
+                        if self._deleted.get(session_id, 0) > generation:
+                            # Deleted after this flush took its snapshot.
+                            continue
+                        written.append((session_id, state) + self._write_row(session_id, state, base, version))
+                    self._conn.execute(
+                        "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.retention_seconds,)
+                    )
+                    self._conn.commit()
+                except Exception:
+                    self._conn.rollback()
+                    raise
+        except Exception:
+            # Nothing was stored; keep the sessions dirty so the next flush retries them.
+            with self._lock:
+                self._dirty.update(session_id for session_id, *_ in pending)
+            raise
+
+        with self._lock:
+            for session_id, flushed, stored, version in written:
+                entry = self._entries.get(session_id)
+                if entry is None:
+                    continue
+                entry["base"], entry["version"] = stored, version
+                if stored != flushed:
+                    # Adopt what the merge took from other workers, keeping edits made here since the flush.
+                    entry["state"] = self._merge(session_id, json.loads(flushed), entry["state"], json.loads(stored))
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self._evict_idle()
+            except Exception as e:
+                logger.error("Session flush failed: %s", e)
+
+    def close(self):
+        self._stop.set()
+        self._flusher.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    # --- in-memory front ---------------------------------------------------
+
+    def _evict(self, session_id: str):
+        if session_id in self._dirty:
+            self.flush()
+        self._entries.pop(session_id, None)
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            idle = [sid for sid, entry in self._entries.items() if entry["accessed_at"] < cutoff]
+            for session_id in idle:
+                self._evict(session_id)
+
+    def _load(self, session_id: str) -> dict:
+        now = time.time()
+        entry = self._entries.get(session_id)
+        if entry is not None and session_id not in self._dirty and now - entry["validated_at"] > self.revalidate_seconds:
+            if (self._read_version(session_id) or 0) > entry["version"]:
+                entry = None
+            else:
+                entry["validated_at"] = now
+
+        if entry is None:
+            row = self._read_row(session_id)
+            if row is not None:
+                base, version = row
+            else:
+                base, version = json.dumps(self.default_factory()), 0
+            entry = {"state": json.loads(base), "base": base, "version": version, "validated_at": now}
+            self._entries[session_id] = entry
+
+        entry["accessed_at"] = now
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._evict(next(iter(self._entries)))
+        return entry
+
+    # --- public API ----------------------------------------------------------
+
+    def get(self, session_id: str) -> dict:
+        """Returns a copy of the session state, creating a default one if needed."""
+        with self._lock:
+            return copy.deepcopy(self._load(session_id)["state"])
+
+    @contextlib.contextmanager
+    def edit(self, session_id: str):
+        """Yields the live session state for in-place modification and schedules it for persistence."""
+        with self._lock:
+            entry = self._load(session_id)
+            try:
+                yield entry["state"]
+            finally:
+                self._dirty.add(session_id)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._deletions += 1
+            if self._flushing:
+                self._deleted[session_id] = self._deletions
+            self._entries.pop(session_id, None)
+            self._dirty.discard(session_id)
+        with self._db_lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
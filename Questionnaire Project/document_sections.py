@@ -0,0 +1,60 @@
+# document_sections.py
+
+import re
+
+# Section boundaries, strongest first; the first kind found at least twice wins.
+_BOUNDARY_PATTERNS = [
+    re.compile(r"^#{1,6}\s+\S"),                          # markdown headings
+    re.compile(r"^\*\*[^*\n]+\*\*:?\s*$"),                 # bold heading lines
+    re.compile(r"^(\d+(\.\d+)*\.?\s+)?[A-Z][^\n.!?]{0,80}:\s*$"),  # "Title:" / "1. Title:" lines
+    re.compile(r"^([-*•]|\d+[.)])\s+\S"),                 # top-level bullets and numbered items
+]
+
+
+def _starts(lines: list, pattern) -> list:
+    return [i for i, line in enumerate(lines) if pattern.match(line)]
+
+
+def split_sections(text: str) -> list:
+    """
+    Splits an LLM-written document into addressable sections, such that
+    "".join(split_sections(text)) == text.
+
+    Markdown headings, bold heading lines or "Title:" lines start a section
+    when the document has at least two of them; otherwise every top-level
+    bullet with its sub-bullets is a section; otherwise every blank-line
+    separated paragraph. Text before the first boundary is a section of its own.
+    """
+    if not text:
+        return []
+    lines = text.splitlines(keepends=True)
+    for pattern in _BOUNDARY_PATTERNS:
+        starts = _starts(lines, pattern)
+        if len(starts) >= 2:
+            break
+    else:
+        starts = [i for i, line in enumerate(lines) if line.strip() and (i == 0 or not lines[i - 1].strip())]
+
+    boundaries = sorted(set([0] + starts)) + [len(lines)]
+    return ["".join(lines[a:b]) for a, b in zip(boundaries, boundaries[1:]) if a < b]
+
+
+def section_title(section: str, limit: int = 100) -> str:
+    """First non-empty line of a section, without markdown markers, for outlines and routing."""
+    for line in section.splitlines():
+        title = line.strip().lstrip("#*-•").strip().strip("*").strip()
+        if title:
+            return title if len(title) <= limit else title[:limit].rstrip() + "…"
+    return ""
+
+
+def replace_section(section: str, revised: str) -> str:
+    """`revised` with the original section's leading/trailing whitespace kept, so neighbours line up unchanged."""
+    stripped = section.strip()
+    if not stripped:
+        return section
+    start = section.index(stripped)
+    leading, trailing = section[:start], section[start + len(stripped):]
+    if not revised.strip():
+        return ""
+    return leading + revised.strip() + trailing
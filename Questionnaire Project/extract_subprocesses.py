@@ -1,21 +1,21 @@
 # extract_subprocesses.py
 
-from core.models import llm_instance
-from vector_utils import load_documents, create_or_load_vectorstore
+import os
+import json
+import hashlib
+import argparse
 
-NUM_SUBPROCESS_DOCS = 5
+from core.models import llm_instance, LLM_MODEL_NAME
+from core.llm_cache import uncached
+from core.metrics import instrument
+from vector_utils import get_retriever, get_corpus_fingerprint
 
-def extract_subprocesses():
-    """Uses RAG + LLM to extract subprocess names from sourcing documents."""
-    documents = load_documents()
-    vectorstore = create_or_load_vectorstore(documents)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": NUM_SUBPROCESS_DOCS})
+NUM_SUBPROCESS_DOCS = 5
+SUBPROCESS_CACHE_PATH = os.path.join("cache", "subprocesses.json")
 
-    query = "List the key subprocesses involved in an SAP Ariba Sourcing project."
-    docs = retriever.get_relevant_documents(query)
-    context = "\n\n".join([doc.page_content for doc in docs])
+SUBPROCESS_QUERY = "List the key subprocesses involved in an SAP Ariba Sourcing project."
 
-    extraction_prompt = f"""
+EXTRACTION_PROMPT = """
 You are a senior SAP consultant. Based on the following content from SAP Ariba Sourcing documents,
 identify the 10 most critical subprocesses involved in the sourcing lifecycle.
 
@@ -39,7 +39,47 @@ Do not provide descriptions or explanations.
 --- CONTEXT END ---
 """
 
-    response = llm_instance.invoke(extraction_prompt)
+def subprocess_cache_key() -> str:
+    """Key over everything the extracted list depends on: corpus, prompt, retrieval and model."""
+    payload = json.dumps([
+        get_corpus_fingerprint(),
+        EXTRACTION_PROMPT,
+        SUBPROCESS_QUERY,
+        NUM_SUBPROCESS_DOCS,
+        LLM_MODEL_NAME,
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def load_cached_subprocesses(key: str):
+    if not os.path.exists(SUBPROCESS_CACHE_PATH):
+        return None
+    try:
+        with open(SUBPROCESS_CACHE_PATH, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable subprocess cache: {e}")
+        return None
+    return cached["subprocesses"] if cached.get("key") == key else None
+
+def save_cached_subprocesses(key: str, subprocesses: list):
+    os.makedirs(os.path.dirname(SUBPROCESS_CACHE_PATH), exist_ok=True)
+    tmp_path = SUBPROCESS_CACHE_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "subprocesses": subprocesses}, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, SUBPROCESS_CACHE_PATH)
+
+@instrument("subprocess_extraction")
+def extract_subprocesses_uncached(bypass_llm_cache: bool = False):
+    """Uses RAG + LLM to extract subprocess names from sourcing documents."""
+    retriever = get_retriever(NUM_SUBPROCESS_DOCS)
+
+    docs = retriever.get_relevant_documents(SUBPROCESS_QUERY)
+    context = "\n\n".join([doc.page_content for doc in docs])
+
+    extraction_prompt = EXTRACTION_PROMPT.format(context=context)
+
+    llm = uncached(llm_instance) if bypass_llm_cache else llm_instance
+    response = llm.invoke(extraction_prompt)
 
     subprocesses = [
         line.strip().lstrip("0123456789.- ").strip()
@@ -48,8 +88,27 @@ Do not provide descriptions or explanations.
     ]
     return subprocesses
 
+def extract_subprocesses(refresh: bool = False):
+    """
+    Returns the subprocess list, reusing the persisted result unless the
+    corpus, the prompt or the model deployment changed, or `refresh` is set.
+    """
+    key = subprocess_cache_key()
+    if not refresh:
+        cached = load_cached_subprocesses(key)
+        if cached is not None:
+            return cached
+
+    subprocesses = extract_subprocesses_uncached(bypass_llm_cache=refresh)
+    save_cached_subprocesses(key, subprocesses)
+    return subprocesses
+
 if __name__ == "__main__":
-    subprocesses = extract_subprocesses()
+    parser = argparse.ArgumentParser(description="Extract the key SAP Ariba Sourcing subprocesses.")
+    parser.add_argument("--refresh", action="store_true", help="ignore the cached list and re-extract")
+    args = parser.parse_args()
+
+    subprocesses = extract_subprocesses(refresh=args.refresh)
     print("✅ Extracted Subprocesses:")
     for idx, sp in enumerate(subprocesses, 1):
         print(f"{idx}. {sp}")
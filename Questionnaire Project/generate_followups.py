@@ -1,10 +1,21 @@
+import os
+import json
+import asyncio
+
 from core.models import llm_instance
-from langchain.prompts import ChatPromptTemplate
+from core.concurrency import LLMCapacityError, ainvoke_limited
+from core.metrics import instrument
+from history_utils import aformat_history_for_prompt, format_history_for_prompt
+from prompt_builder import LayeredPrompt
+
+# "batch" asks for all follow-ups in one structured response; "iterative" asks for one at a time.
+FOLLOWUP_MODE = os.getenv("FOLLOWUP_MODE", "batch")
+MAX_FOLLOWUPS = int(os.getenv("MAX_FOLLOWUPS", 2))
 
-# Updated prompt template to support iterative follow-up generation
-FOLLOWUP_PERSONA = ChatPromptTemplate.from_messages([
-    (
-        "system",
+# Updated prompt template to support iterative follow-up generation.
+# Layers run static -> semi-static -> dynamic so repeated calls share a cacheable prefix.
+FOLLOWUP_PERSONA = LayeredPrompt(
+    static=(
         "You are a senior SAP consultant.\n"
         "Your job is to decide whether another follow-up question is needed for the current Q&A.\n"
         "- Use the original question and answer\n"
@@ -13,16 +24,37 @@ FOLLOWUP_PERSONA = ChatPromptTemplate.from_messages([
         "Ask ONLY ONE new follow-up if it adds significant depth or clarity.\n"
         "If no further follow-up is meaningful, return nothing.\n"
     ),
-    (
-        "human",
+    semi_static="Relevant Business Context from Documents:\n{rag_context}\n\n",
+    dynamic=(
+        "Full Conversation History:\n{conversation_history}\n\n"
         "Original Question:\n{question}\n\n"
         "User Answer:\n{answer}\n\n"
         "Previous Follow-ups and Answers:\n{prior_followups}\n\n"
-        "Relevant Business Context from Documents:\n{rag_context}\n\n"
-        "Full Conversation History:\n{conversation_history}\n\n"
         "Suggest ONE additional follow-up question (plain text only). If none is needed, return nothing."
-    )
-])
+    ),
+)
+
+# Single-call template that returns an ordered list of follow-ups
+FOLLOWUP_BATCH_PERSONA = LayeredPrompt(
+    static=(
+        "You are a senior SAP consultant.\n"
+        "Your job is to decide which follow-up questions, if any, are needed for the current Q&A.\n"
+        "- Use the original question and answer\n"
+        "- Consider the full business context and conversation so far\n\n"
+        "Order follow-ups from most to least important.\n"
+        "Each follow-up must add significant depth or clarity and must not overlap with the others.\n"
+        "Stop as soon as a further follow-up would not be meaningful; return an empty list if none is needed.\n\n"
+        "Respond with JSON only, in the form {{\"followups\": [\"first question\", \"second question\"]}}.\n"
+    ),
+    semi_static="Relevant Business Context from Documents:\n{rag_context}\n\n",
+    dynamic=(
+        "Full Conversation History:\n{conversation_history}\n\n"
+        "Original Question:\n{question}\n\n"
+        "User Answer:\n{answer}\n\n"
+        "Ask at most {max_followups} follow-ups. "
+        "Return the JSON object with the follow-up questions (plain text only)."
+    ),
+)
 
 def format_followups_for_prompt(followups: list) -> str:
     """Formats previous follow-ups for the prompt."""
@@ -33,17 +65,27 @@ def format_followups_for_prompt(followups: list) -> str:
         output += f"{i}. Q: {item['question']}\n   A: {item['answer']}\n"
     return output.strip()
 
-def format_history_for_prompt(convo: list) -> str:
-    """Formats full conversation history for prompt context."""
-    history_text = ""
-    for i, entry in enumerate(convo, 1):
-        history_text += f"Q{i}: {entry['question']}\n"
-        history_text += f"A{i}: {entry['answer']}\n"
-        for j, fup in enumerate(entry.get("followups", []), 1):
-            history_text += f"  ↳ Follow-up {j}: {fup['question']}\n"
-            history_text += f"     Answer: {fup['answer']}\n"
-    return history_text.strip()
+def build_followup_prompt(
+    question: str,
+    answer: str,
+    prior_followups: list,
+    rag_context: str,
+    conversation_history: list,
+    formatted_history: str = None
+):
+    if formatted_history is None:
+        formatted_history = format_history_for_prompt(conversation_history)
+    formatted_followups = format_followups_for_prompt(prior_followups)
+
+    return FOLLOWUP_PERSONA.format_messages(
+        question=question,
+        answer=answer,
+        prior_followups=formatted_followups,
+        rag_context=rag_context,
+        conversation_history=formatted_history
+    )
 
+@instrument("followups")
 def generate_next_followup(
     question: str,
     answer: str,
@@ -52,19 +94,11 @@ def generate_next_followup(
     conversation_history: list
 ) -> str:
     """
-    Generates ONE follow-up question using LLM, or returns empty string if none is meaningful.
+    Generates ONE follow-up question using LLM, or returns empty string if none is meaningful
+    or the call still fails after retries.
     """
     try:
-        formatted_history = format_history_for_prompt(conversation_history)
-        formatted_followups = format_followups_for_prompt(prior_followups)
-
-        prompt = FOLLOWUP_PERSONA.format_messages(
-            question=question,
-            answer=answer,
-            prior_followups=formatted_followups,
-            rag_context=rag_context,
-            conversation_history=formatted_history
-        )
+        prompt = build_followup_prompt(question, answer, prior_followups, rag_context, conversation_history)
 
         response = llm_instance.invoke(prompt)
         next_question = response.content.strip()
@@ -72,21 +106,137 @@ def generate_next_followup(
         return next_question if next_question else ""
 
     except Exception as e:
-        return f"[Error generating next follow-up: {e}]"
+        # Retries happen below the model; a call that still fails means no follow-up this turn.
+        print(f"Follow-up generation failed, skipping: {e}")
+        return ""
 
-def generate_all_followups(
+@instrument("followups")
+async def agenerate_next_followup(
     question: str,
     answer: str,
+    prior_followups: list,
     rag_context: str,
     conversation_history: list
+) -> str:
+    """
+    Async variant of generate_next_followup, admitted through the shared LLM limiter.
+    Capacity errors are raised so the caller can shed load instead of showing them as a question.
+    """
+    try:
+        formatted_history = await aformat_history_for_prompt(conversation_history)
+        prompt = build_followup_prompt(question, answer, prior_followups, rag_context, conversation_history, formatted_history)
+
+        response = await ainvoke_limited(llm_instance, prompt)
+        next_question = response.content.strip()
+
+        return next_question if next_question else ""
+
+    except LLMCapacityError:
+        raise
+    except Exception as e:
+        print(f"Follow-up generation failed, skipping: {e}")
+        return ""
+
+def build_followup_batch_prompt(
+    question: str,
+    answer: str,
+    rag_context: str,
+    conversation_history: list,
+    max_followups: int,
+    formatted_history: str = None
+):
+    if formatted_history is None:
+        formatted_history = format_history_for_prompt(conversation_history)
+    return FOLLOWUP_BATCH_PERSONA.format_messages(
+        question=question,
+        answer=answer,
+        rag_context=rag_context,
+        conversation_history=formatted_history,
+        max_followups=max_followups
+    )
+
+def parse_followup_batch(content: str, max_followups: int) -> list:
+    """Parses the batched JSON response; raises ValueError if it is not well-formed."""
+    text = content.strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"No JSON object in follow-up response: {text[:200]!r}")
+    parsed = json.loads(text[start:end + 1])
+    if not isinstance(parsed, dict):
+        raise ValueError(f"Follow-up response is not a JSON object: {text[:200]!r}")
+    followups = parsed.get("followups")
+    if not isinstance(followups, list) or not all(isinstance(q, str) for q in followups):
+        raise ValueError(f"Malformed follow-up list: {followups!r}")
+
+    questions = []
+    for q in followups:
+        q = q.strip()
+        if not q:
+            break
+        questions.append(q)
+    return questions[:max_followups]
+
+@instrument("followups")
+def generate_followups_batch(
+    question: str,
+    answer: str,
+    rag_context: str,
+    conversation_history: list,
+    max_followups: int = MAX_FOLLOWUPS
+) -> list:
+    """
+    Generates up to `max_followups` ordered follow-up questions in one LLM call.
+    Returns an empty list if none is meaningful.
+    """
+    prompt = build_followup_batch_prompt(question, answer, rag_context, conversation_history, max_followups)
+    response = llm_instance.invoke(prompt)
+    return parse_followup_batch(response.content, max_followups)
+
+@instrument("followups")
+async def agenerate_followups_batch(
+    question: str,
+    answer: str,
+    rag_context: str,
+    conversation_history: list,
+    max_followups: int = MAX_FOLLOWUPS
+) -> list:
+    """
+    Async variant of generate_followups_batch.
+    """
+    formatted_history = await aformat_history_for_prompt(conversation_history)
+    prompt = build_followup_batch_prompt(question, answer, rag_context, conversation_history, max_followups, formatted_history)
+    response = await ainvoke_limited(llm_instance, prompt)
+    return parse_followup_batch(response.content, max_followups)
+
+def generate_all_followups(
+    question: str,
+    answer: str,
+    rag_context: str,
+    conversation_history: list,
+    max_followups: int = MAX_FOLLOWUPS,
+    mode: str = FOLLOWUP_MODE
 ) -> list:
     """
-    Iteratively generates up to 2 follow-up questions per original Q&A.
+    Generates up to `max_followups` follow-up questions per original Q&A, in one
+    batched call or iteratively depending on `mode`. A batched response that
+    cannot be parsed falls back to the iterative mode; a batched call that
+    still fails after retries yields no follow-ups.
     Returns a list of follow-up dicts with empty answers (to be filled in via UI).
     """
+    if mode == "batch":
+        try:
+            questions = generate_followups_batch(question, answer, rag_context, conversation_history, max_followups)
+            return [{"question": q, "answer": ""} for q in questions]
+        except ValueError as e:
+            print(f"Batched follow-up response unusable, falling back to iterative: {e}")
+        except Exception as e:
+            # Transient errors were already retried below the model; more calls would not help.
+            print(f"Follow-up generation failed, skipping: {e}")
+            return []
+
     followups = []
 
-    for _ in range(2):  # Max 2 follow-ups
+    for _ in range(max_followups):
         next_q = generate_next_followup(
             question=question,
             answer=answer,
@@ -104,3 +254,47 @@ def generate_all_followups(
         })
 
     return followups
+
+async def agenerate_all_followups(
+    question: str,
+    answer: str,
+    rag_context: str,
+    conversation_history: list,
+    max_followups: int = MAX_FOLLOWUPS,
+    mode: str = FOLLOWUP_MODE
+) -> list:
+    """
+    Async variant of generate_all_followups.
+    """
+    if mode == "batch":
+        try:
+            questions = await agenerate_followups_batch(question, answer, rag_context, conversation_history, max_followups)
+            return [{"question": q, "answer": ""} for q in questions]
+        except LLMCapacityError:
+            raise
+        except ValueError as e:
+            print(f"Batched follow-up response unusable, falling back to iterative: {e}")
+        except Exception as e:
+            print(f"Follow-up generation failed, skipping: {e}")
+            return []
+
+    followups = []
+
+    for _ in range(max_followups):
+        next_q = await agenerate_next_followup(
+            question=question,
+            answer=answer,
+            prior_followups=followups,
+            rag_context=rag_context,
+            conversation_history=conversation_history
+        )
+
+        if not next_q:
+            break
+
+        followups.append({
+            "question": next_q,
+            "answer": ""
+        })
+
+    return followups
@@ -2,19 +2,7 @@
 
 from core.models import llm_instance
 from persona_prompt import QUESTION_PERSONA
-
-def format_history_for_prompt(conversation_history: list) -> str:
-    """
-    Convert structured Q&A history (including follow-ups) into a readable string for the LLM.
-    """
-    history_text = ""
-    for i, entry in enumerate(conversation_history, 1):
-        history_text += f"Q{i}: {entry['question']}\n"
-        history_text += f"A{i}: {entry['answer']}\n"
-        for j, fup in enumerate(entry.get("followups", []), 1):
-            history_text += f"  \u21b3 Follow-up {j}: {fup['question']}\n"
-            history_text += f"     Answer: {fup['answer']}\n"
-    return history_text.strip()
+from history_utils import format_history_for_prompt
 
 def generate_suggested_questions(user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str) -> list:
     """
@@ -27,16 +15,17 @@ def generate_suggested_questions(user_choices: dict, rag_context: str, conversat
     Returns a list of 1 or more high-quality questions.
     """
     try:
-        formatted_history = format_history_for_prompt(conversation_history)
+        formatted_history = format_history_for_prompt(conversation_history, current_subprocess=sub_process_name)
 
         context_for_prompt = {
             "user_choices": user_choices,
             "rag_context": rag_context,
             "conversation_history": formatted_history,
-            "sub_process_name": sub_process_name
+            "sub_process_name": sub_process_name,
+            "probing_focus": ""
         }
 
-        formatted_prompt = QUESTION_PERSONA.format_messages(context=context_for_prompt)
+        formatted_prompt = QUESTION_PERSONA.format_messages(**context_for_prompt)
         response = llm_instance.invoke(formatted_prompt)
 
         lines = response.content.strip().split("\n")
@@ -1,22 +1,51 @@
+import asyncio
+
 from core.models import llm_instance
+from core.concurrency import LLMCapacityError, ainvoke_limited
+from core.metrics import instrument
 from persona_prompt import QUESTION_PERSONA
 from probing_focus import get_llm_probing_focus  
+from history_utils import aformat_history_for_prompt, format_history_for_prompt
 
 
-def format_history_for_prompt(conversation_history: list) -> str:
-    """
-    Convert structured Q&A history (including follow-ups) into a readable string for the LLM.
-    """
-    history_text = ""
-    for i, entry in enumerate(conversation_history, 1):
-        history_text += f"Q{i}: {entry['question']}\n"
-        history_text += f"A{i}: {entry['answer']}\n"
-        for j, fup in enumerate(entry.get("followups", []), 1):
-            history_text += f"  ↳ Follow-up {j}: {fup['question']}\n"
-            history_text += f"     Answer: {fup['answer']}\n"
-    return history_text.strip()
+def build_suggested_questions_prompt(
+    user_choices: dict,
+    rag_context: str,
+    conversation_history: list,
+    sub_process_name: str,
+    formatted_history: str = None
+):
+    # Format the history for the prompt
+    if formatted_history is None:
+        formatted_history = format_history_for_prompt(conversation_history, current_subprocess=sub_process_name)
+
+    # 🔍 Get dynamic probing cues based on subprocess + user dimension filters
+    probing_focus = get_llm_probing_focus(subprocess=sub_process_name, user_choices=user_choices)
 
+    # Combine all context into a single dict for the persona prompt
+    context_for_prompt = {
+        "user_choices": user_choices,
+        "rag_context": rag_context,
+        "conversation_history": formatted_history,
+        "sub_process_name": sub_process_name,
+        "probing_focus": probing_focus # ✅ Injected into the prompt context
+    }
 
+    # Fill in the persona template
+    return QUESTION_PERSONA.format_messages(**context_for_prompt)
+
+
+def parse_suggested_questions(content: str) -> list:
+    # Extract and clean the questions
+    lines = content.strip().split("\n")
+    return [
+        line.strip("-•* ").strip()
+        for line in lines
+        if line.strip()
+    ]
+
+
+@instrument("suggested_questions")
 def generate_suggested_questions(
     user_choices: dict,
     rag_context: str,
@@ -33,36 +62,40 @@ def generate_suggested_questions(
     Returns a list of 1 or more high-quality questions.
     """
     try:
-        # Format the history for the prompt
-        formatted_history = format_history_for_prompt(conversation_history)
+        formatted_prompt = build_suggested_questions_prompt(
+            user_choices, rag_context, conversation_history, sub_process_name
+        )
+
+        # Call the LLM
+        response = llm_instance.invoke(formatted_prompt)
 
-        # 🔍 Get dynamic probing cues based on subprocess + user dimension filters
-        probing_focus = get_llm_probing_focus(subprocess=sub_process_name, user_choices=user_choices)
+        return parse_suggested_questions(response.content)
 
-        # Combine all context into a single dict for the persona prompt
-        context_for_prompt = {
-            "user_choices": user_choices,
-            "rag_context": rag_context,
-            "conversation_history": formatted_history,
-            "sub_process_name": sub_process_name,
-            "probing_focus": get_llm_probing_focus(sub_process_name, user_choices) # ✅ Injected into the prompt context
-        }
+    except Exception as e:
+        return [f"[Error generating suggested questions: {e}]"]
 
-        # Fill in the persona template
-        formatted_prompt = QUESTION_PERSONA.format_messages(context=context_for_prompt)
 
-        # Call the LLM
-        response = llm_instance.invoke(formatted_prompt)
+@instrument("suggested_questions")
+async def agenerate_suggested_questions(
+    user_choices: dict,
+    rag_context: str,
+    conversation_history: list,
+    sub_process_name: str
+) -> list:
+    """
+    Async variant of generate_suggested_questions, admitted through the shared LLM limiter.
+    """
+    try:
+        formatted_history = await aformat_history_for_prompt(conversation_history, current_subprocess=sub_process_name)
+        formatted_prompt = await asyncio.to_thread(
+            build_suggested_questions_prompt, user_choices, rag_context, conversation_history, sub_process_name, formatted_history
+        )
 
-        # Extract and clean the questions
-        lines = response.content.strip().split("\n")
-        questions = [
-            line.strip("-•* ").strip()
-            for line in lines
-            if line.strip()
-        ]
+        response = await ainvoke_limited(llm_instance, formatted_prompt)
 
-        return questions
+        return parse_suggested_questions(response.content)
 
+    except LLMCapacityError:
+        raise
     except Exception as e:
         return [f"[Error generating suggested questions: {e}]"]
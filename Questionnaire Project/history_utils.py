@@ -0,0 +1,214 @@
+# history_utils.py
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+
+from core.lru import LRUCache
+from core.models import llm_instance, LLM_BACKEND
+from core.metrics import instrument
+from core.concurrency import ainvoke_limited
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 3000))
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", 2))
+HISTORY_SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("HISTORY_SUMMARY_CACHE_MAX_ENTRIES", 2000))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+# "tiktoken" counts exactly; "estimate" never loads a tokenizer, so the offline
+# fake backend needs no network access.
+TOKENIZER = os.getenv("TOKENIZER", "estimate" if LLM_BACKEND == "fake" else "tiktoken")
+
+# Used when the tokenizer cannot be loaded (tiktoken fetches it on first use).
+CHARS_PER_TOKEN = 4
+
+EARLIER_DISCUSSION = "Earlier discussion"
+
+_encoding = None
+_encoding_failed = False
+_summary_cache = LRUCache(HISTORY_SUMMARY_CACHE_MAX_ENTRIES)
+
+
+def _get_encoding():
+    """The model's tokenizer, or None if it is unavailable and token counts are estimated."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed and TOKENIZER == "tiktoken":
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            _encoding_failed = True
+            logger.warning("Tokenizer %s unavailable, estimating token counts: %s", TOKENIZER_ENCODING, e)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count of `text` under the model's tokenizer, or an estimate if it cannot be loaded."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def clip_to_tokens(text: str, budget: int, keep_end: bool = False) -> str:
+    """The first (or, with keep_end, the last) `budget` tokens of `text`."""
+    encoding = _get_encoding()
+    if encoding is None:
+        limit = budget * CHARS_PER_TOKEN
+        return text if len(text) <= limit else (text[-limit:] if keep_end else text[:limit])
+    tokens = encoding.encode(text)
+    if len(tokens) <= budget:
+        return text
+    return encoding.decode(tokens[-budget:] if keep_end else tokens[:budget])
+
+
+def format_history_entry(index: int, entry: dict, marker: str = "") -> str:
+    """Renders one Q&A entry (with its follow-ups) the way every prompt shows it."""
+    text = f"Q{index}{marker}: {entry['question']}\n"
+    text += f"A{index}: {entry['answer']}\n"
+    for j, fup in enumerate(entry.get("followups", []), 1):
+        text += f"  ↳ Follow-up {j}: {fup['question']}\n"
+        text += f"     Answer: {fup['answer']}\n"
+    return text
+
+
+def _summary_request(sub_process_name: str, indexed_entries: list) -> tuple:
+    rendered = "".join(format_history_entry(i, entry) for i, entry in indexed_entries)
+    key = hashlib.sha256(json.dumps([sub_process_name, rendered]).encode("utf-8")).hexdigest()
+    prompt = (
+        f"You are a SAP consultant. Summarize the following discovery Q&A about the sub-process "
+        f"\"{sub_process_name}\" in at most 5 concise bullet points. Keep concrete facts such as systems, "
+        f"volumes, approval levels, templates and pain points; drop pleasantries and repetition.\n\n{rendered}"
+    )
+    return key, prompt
+
+
+@instrument("history_summary")
+def summarize_subprocess_history(sub_process_name: str, indexed_entries: list) -> str:
+    """
+    Rolling summary of the Q&A for one earlier subprocess. Summaries are cached
+    by the content of the entries they cover, so each is only produced once
+    unless an answer in it changes.
+    """
+    key, prompt = _summary_request(sub_process_name, indexed_entries)
+    summary = _summary_cache.get(key)
+    if summary is None:
+        summary = llm_instance.invoke(prompt).content.strip()
+        _summary_cache.put(key, summary)
+    return summary
+
+
+@instrument("history_summary")
+async def asummarize_subprocess_history(sub_process_name: str, indexed_entries: list) -> str:
+    """Async version of summarize_subprocess_history; the LLM call goes through the shared limiter."""
+    key, prompt = _summary_request(sub_process_name, indexed_entries)
+    summary = _summary_cache.get(key)
+    if summary is None:
+        summary = (await ainvoke_limited(llm_instance, prompt)).content.strip()
+        _summary_cache.put(key, summary)
+    return summary
+
+
+def format_entries_for_prompt(indexed_entries: list, token_budget: int) -> str:
+    """
+    Renders (index, entry) pairs of one subprocess within `token_budget`
+    tokens, dropping the oldest entries first and always keeping the latest.
+    """
+    texts = [format_history_entry(i, entry) for i, entry in indexed_entries]
+    if token_budget > 0:
+        counts = [count_tokens(text) for text in texts]
+        total = sum(counts)
+        while len(texts) > 1 and total > token_budget:
+            total -= counts.pop(0)
+            texts.pop(0)
+    text = "".join(texts).strip()
+    return clip_to_tokens(text, token_budget, keep_end=True) if token_budget > 0 else text
+
+
+def _plan_history(conversation_history: list, budget: int, current_subprocess: str = None) -> tuple:
+    """
+    Returns (full_text, None) when the whole history fits in `budget`, else
+    (None, sections): the verbatim turns and the older subprocess groups to summarize.
+    """
+    full_text = "".join(
+        format_history_entry(i, entry) for i, entry in enumerate(conversation_history, 1)
+    ).strip()
+    if budget <= 0 or count_tokens(full_text) <= budget:
+        return full_text, None
+
+    if current_subprocess is None and conversation_history:
+        current_subprocess = conversation_history[-1].get("subprocess")
+
+    recent_start = max(0, len(conversation_history) - HISTORY_RECENT_TURNS)
+    sections = []
+    older_groups = {}
+    for position, entry in enumerate(conversation_history):
+        index = position + 1
+        sub_process_name = entry.get("subprocess") or EARLIER_DISCUSSION
+        if position >= recent_start or (current_subprocess and sub_process_name == current_subprocess):
+            sections.append({"kind": "verbatim", "text": format_history_entry(index, entry)})
+            continue
+        group = older_groups.get(sub_process_name)
+        if group is None:
+            group = older_groups[sub_process_name] = {"kind": "summary", "name": sub_process_name, "entries": []}
+            sections.append(group)
+        group["entries"].append((index, entry))
+    return None, sections
+
+
+def _set_summary_text(section: dict, summary: str):
+    first, last = section["entries"][0][0], section["entries"][-1][0]
+    span = f"Q{first}" if first == last else f"Q{first}-Q{last}"
+    section["text"] = f"[Summary of {section['name']} ({span})]\n{summary}\n"
+
+
+def _fit_sections(sections: list, budget: int) -> str:
+    # Drop summaries oldest-first, then older verbatim turns, always keeping the latest turn.
+    while len(sections) > 1:
+        text = "".join(section["text"] for section in sections).strip()
+        if count_tokens(text) <= budget:
+            return text
+        summaries = [i for i, section in enumerate(sections) if section["kind"] == "summary"]
+        sections.pop(summaries[0] if summaries else 0)
+
+    text = sections[0]["text"].strip() if sections else ""
+    return clip_to_tokens(text, budget, keep_end=True)
+
+
+def format_history_for_prompt(conversation_history: list, token_budget: int = None, current_subprocess: str = None) -> str:
+    """
+    Convert structured Q&A history (including follow-ups) into a readable string for the LLM.
+
+    If the full history fits in `token_budget` tokens it is returned verbatim.
+    Otherwise the most recent turns and every turn of the current subprocess
+    stay verbatim, older subprocesses are replaced by cached rolling
+    summaries, and the oldest sections are dropped until the text fits.
+    """
+    budget = HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+    full_text, sections = _plan_history(conversation_history, budget, current_subprocess)
+    if sections is None:
+        return full_text
+    for section in sections:
+        if section["kind"] == "summary":
+            _set_summary_text(section, summarize_subprocess_history(section["name"], section["entries"]))
+    return _fit_sections(sections, budget)
+
+
+async def aformat_history_for_prompt(conversation_history: list, token_budget: int = None, current_subprocess: str = None) -> str:
+    """
+    Async version of format_history_for_prompt: missing summaries are
+    produced concurrently through the shared LLM limiter, and tokenizing
+    runs off the event loop.
+    """
+    budget = HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+    full_text, sections = await asyncio.to_thread(_plan_history, conversation_history, budget, current_subprocess)
+    if sections is None:
+        return full_text
+    groups = [section for section in sections if section["kind"] == "summary"]
+    summaries = await asyncio.gather(*(asummarize_subprocess_history(g["name"], g["entries"]) for g in groups))
+    for section, summary in zip(groups, summaries):
+        _set_summary_text(section, summary)
+    return await asyncio.to_thread(_fit_sections, sections, budget)
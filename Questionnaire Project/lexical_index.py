@@ -0,0 +1,95 @@
+# lexical_index.py
+
+import re
+import math
+import threading
+from collections import Counter
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by do does for from how in is it of on or our the their this to
+what when where which who why with your you we
+""".split())
+
+
+def tokenize(text: str) -> list:
+    """Lower-cased alphanumeric terms without stopwords ("Full/Quick Project" -> full, quick, project)."""
+    return [term for term in _TOKEN_RE.findall(text.lower()) if term not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 scoring.
+
+    Postings map each term to {doc_id: term frequency}. Documents can be added
+    and removed incrementally, so the index can follow the vectorstore chunk by
+    chunk instead of being rebuilt.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._lengths = {}
+        self._texts = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, doc_ids: list, texts: list):
+        with self._lock:
+            for doc_id, text in zip(doc_ids, texts):
+                if doc_id in self._lengths:
+                    self._remove(doc_id)
+                terms = tokenize(text)
+                for term, count in Counter(terms).items():
+                    self._postings.setdefault(term, {})[doc_id] = count
+                self._lengths[doc_id] = len(terms)
+                self._texts[doc_id] = text
+                self._total_length += len(terms)
+
+    def remove(self, doc_ids: list):
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id in self._lengths:
+                    self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        for term in set(tokenize(self._texts[doc_id])):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id)
+        del self._texts[doc_id]
+
+    def text(self, doc_id: str) -> str:
+        return self._texts[doc_id]
+
+    def known_terms(self, query: str) -> tuple:
+        """Returns (query terms, how many of them occur in the corpus)."""
+        terms = tokenize(query)
+        with self._lock:
+            return terms, sum(1 for term in terms if term in self._postings)
+
+    def search(self, query: str, k: int) -> list:
+        """Top-k (doc_id, score) pairs for the query, best first; documents sharing no term are skipped."""
+        with self._lock:
+            n = len(self._lengths)
+            if not n:
+                return []
+            average_length = self._total_length / n
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
@@ -0,0 +1,386 @@
+# mmap_vector_store.py
+
+import os
+import json
+import uuid
+import threading
+import contextlib
+from typing import Any, List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialised within one process
+    fcntl = None
+
+FORMAT_VERSION = 1
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+class MmapRetriever(BaseRetriever):
+    """Similarity retriever over an MmapVectorStore, the counterpart of Chroma's as_retriever()."""
+
+    store: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return self.store.similarity_search(query, k=self.k)
+
+
+class MmapVectorStore:
+    """
+    Local vector index stored as a memory-mapped float16 matrix of normalised
+    embeddings plus a JSON-lines sidecar with the ids, texts and metadata.
+    `dtype="float32"` doubles the file size but skips the per-query float16
+    conversion; it only applies when a store is created.
+
+    Both files are append-only: an add appends rows to the matrix and one
+    record per row to the sidecar, a delete appends a tombstone record. Every
+    process maps the same file read-only, so several API workers share its
+    pages through the OS page cache instead of each holding a copy, and they
+    pick up other processes' writes by replaying the new sidecar lines. When
+    tombstones outnumber live rows the store is compacted into a new
+    generation of files.
+
+    Search is exact top-k by blocked NumPy dot products. With `ivf_lists` > 0
+    and at least `ivf_min_rows` live rows, a coarse IVF partition (spherical
+    k-means centroids) restricts each query to the rows of its `ivf_probe`
+    nearest lists.
+    """
+
+    def __init__(self, path: str, embedding_function, ivf_lists: int = 0, ivf_probe: int = 8,
+                 ivf_min_rows: int = 20000, block_rows: int = 1024, dtype: str = "float16"):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.ivf_lists = ivf_lists
+        self.ivf_probe = ivf_probe
+        self.ivf_min_rows = ivf_min_rows
+        self.block_rows = block_rows
+        self.dtype = dtype
+        os.makedirs(path, exist_ok=True)
+        self._rows_path = os.path.join(path, "rows.jsonl")
+        self._lock = threading.RLock()
+        self._reset()
+
+    # -- state --------------------------------------------------------------
+
+    def _reset(self):
+        self._header = None
+        self._offset = 0
+        self._seen = None
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._row_of = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._matrix = None
+        self._ivf = None
+
+    @property
+    def dimensions(self):
+        return self._header["dim"] if self._header else None
+
+    def _vectors_path(self, header: dict) -> str:
+        return os.path.join(self.path, header["vectors"])
+
+    def _apply(self, record: dict):
+        if "delete" in record:
+            for doc_id in record["delete"]:
+                row = self._row_of.pop(doc_id, None)
+                if row is not None:
+                    self._alive[row] = False
+            return
+        row = len(self._ids)
+        if self._row_of.get(record["id"]) is not None:
+            self._alive[self._row_of[record["id"]]] = False
+        self._ids.append(record["id"])
+        self._texts.append(record["text"])
+        self._metadatas.append(record.get("metadata") or {})
+        self._row_of[record["id"]] = row
+        if row >= len(self._alive):
+            self._alive = np.concatenate([self._alive, np.zeros(max(1024, row), dtype=bool)])
+        self._alive[row] = True
+
+    def _refresh(self):
+        """Replays sidecar records written since the last call, by this or any other process."""
+        try:
+            stat = os.stat(self._rows_path)
+        except FileNotFoundError:
+            if self._header is not None:
+                self._reset()
+            return
+        # Compaction replaces the file, so a new inode means a new generation.
+        if self._header is not None and (stat.st_ino, stat.st_size) == self._seen:
+            return
+        size = stat.st_size
+
+        with open(self._rows_path, "rb") as f:
+            header = json.loads(f.readline())
+            if self._header is None or header["generation"] != self._header["generation"]:
+                self._reset()
+                self._header = header
+                self._offset = f.tell()
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # Only complete lines: a writer may be midway through appending.
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+        self._offset += len(complete)
+        self._seen = (stat.st_ino, self._offset)
+
+        rows = len(self._ids)
+        if rows and (self._matrix is None or self._matrix.shape[0] != rows):
+            self._matrix = np.memmap(
+                self._vectors_path(self._header), dtype=self._header["dtype"], mode="r", shape=(rows, self._header["dim"])
+            )
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        with self._lock:
+            with open(os.path.join(self.path, ".lock"), "a+b") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_header(self, path: str, dim: int, dtype: str) -> dict:
+        generation = uuid.uuid4().hex
+        header = {
+            "format": FORMAT_VERSION, "dim": dim, "dtype": dtype,
+            "generation": generation, "vectors": f"vectors-{generation}.{dtype}",
+        }
+        with open(path, "wb") as f:
+            f.write((json.dumps(header) + "\n").encode("utf-8"))
+        return header
+
+    # -- writes -------------------------------------------------------------
+
+    def add_vectors(self, ids: list, vectors, texts: list, metadatas: list = None):
+        """Stores precomputed embeddings; an id that already exists is replaced."""
+        if not ids:
+            return []
+        vectors = _normalize(vectors)
+        metadatas = metadatas or [{} for _ in ids]
+        with self._write_lock():
+            if self._header is None:
+                self._header = self._write_header(self._rows_path, vectors.shape[1], self.dtype)
+                self._offset = os.path.getsize(self._rows_path)
+            if vectors.shape[1] != self._header["dim"]:
+                raise ValueError(f"Expected {self._header['dim']}-dimensional vectors, got {vectors.shape[1]}.")
+
+            # Vectors first, at the row the sidecar will give them; rows past the
+            # sidecar's count (from an interrupted write) are overwritten.
+            vectors = vectors.astype(self._header["dtype"])
+            vectors_path = self._vectors_path(self._header)
+            with open(vectors_path, "r+b" if os.path.exists(vectors_path) else "wb") as f:
+                f.seek(len(self._ids) * vectors.shape[1] * vectors.itemsize)
+                f.write(vectors.tobytes())
+                if os.fstat(f.fileno()).st_size > f.tell():
+                    f.truncate()
+            lines = "".join(
+                json.dumps({"id": doc_id, "text": text, "metadata": metadata}, ensure_ascii=False) + "\n"
+                for doc_id, text, metadata in zip(ids, texts, metadatas)
+            )
+            with open(self._rows_path, "ab") as f:
+                f.write(lines.encode("utf-8"))
+            self._refresh()
+        return list(ids)
+
+    def add_texts(self, texts: list, metadatas: list = None, ids: list = None):
+        texts = list(texts)
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        return self.add_vectors(ids, self.embedding_function.embed_documents(texts), texts, metadatas)
+
+    def add_documents(self, documents: list, ids: list = None):
+        return self.add_texts([d.page_content for d in documents], [d.metadata for d in documents], ids)
+
+    def delete(self, ids: list = None):
+        if not ids:
+            return
+        with self._write_lock():
+            if self._header is None:
+                return
+            with open(self._rows_path, "ab") as f:
+                f.write((json.dumps({"delete": list(ids)}) + "\n").encode("utf-8"))
+            self._refresh()
+            dead = len(self._ids) - len(self._row_of)
+            if dead > max(1024, len(self._row_of)):
+                self._compact()
+
+    def _compact(self):
+        """Rewrites the live rows into a new generation of files (caller holds the write lock)."""
+        old_header = self._header
+        rows = np.flatnonzero(self._alive[:len(self._ids)])
+        tmp_rows_path = self._rows_path + ".tmp"
+        header = self._write_header(tmp_rows_path, old_header["dim"], old_header["dtype"])
+        with open(self._vectors_path(header), "wb") as f:
+            for start in range(0, len(rows), self.block_rows):
+                f.write(np.asarray(self._matrix[rows[start:start + self.block_rows]]).tobytes())
+        with open(tmp_rows_path, "ab") as f:
+            for row in rows:
+                record = {"id": self._ids[row], "text": self._texts[row], "metadata": self._metadatas[row]}
+                f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        os.replace(tmp_rows_path, self._rows_path)
+        self._reset()
+        self._refresh()
+        # Other processes may still map the old file; on POSIX it lives on until they remap.
+        with contextlib.suppress(OSError):
+            os.remove(self._vectors_path(old_header))
+
+    # -- reads --------------------------------------------------------------
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._row_of)
+
+    def get(self, ids: list = None, include: list = ("documents", "metadatas")) -> dict:
+        """Chroma-style bulk read of live rows: {"ids", and any of "documents", "metadatas", "embeddings"}."""
+        with self._lock:
+            self._refresh()
+            if ids is None:
+                rows = np.flatnonzero(self._alive[:len(self._ids)])
+            else:
+                rows = np.array([self._row_of[doc_id] for doc_id in ids if doc_id in self._row_of], dtype=np.int64)
+            result = {"ids": [self._ids[row] for row in rows]}
+            if "documents" in include:
+                result["documents"] = [self._texts[row] for row in rows]
+            if "metadatas" in include:
+                result["metadatas"] = [self._metadatas[row] for row in rows]
+            if "embeddings" in include:
+                dim = self.dimensions or 0
+                result["embeddings"] = (
+                    np.asarray(self._matrix[rows], dtype=np.float32) if len(rows) else np.zeros((0, dim), np.float32)
+                )
+            return result
+
+    def text(self, doc_id: str) -> str:
+        with self._lock:
+            return self._texts[self._row_of[doc_id]]
+
+    def _merge_top(self, best: tuple, scores: np.ndarray, rows: np.ndarray, k: int) -> tuple:
+        best_scores, best_rows = best
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(rows, (scores.shape[0], len(rows)))], axis=1)
+        if scores.shape[1] > k:
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores, rows = np.take_along_axis(scores, keep, axis=1), np.take_along_axis(rows, keep, axis=1)
+        return scores, rows
+
+    def _exact(self, queries: np.ndarray, k: int) -> tuple:
+        best = (np.zeros((len(queries), 0), np.float32), np.zeros((len(queries), 0), np.int64))
+        n = len(self._ids)
+        for start in range(0, n, self.block_rows):
+            end = min(n, start + self.block_rows)
+            scores = queries @ np.asarray(self._matrix[start:end], dtype=np.float32).T
+            scores[:, ~self._alive[start:end]] = -np.inf
+            best = self._merge_top(best, scores, np.arange(start, end), k)
+        return best
+
+    def _partition(self, ivf: dict):
+        order = np.argsort(ivf["assignment"], kind="stable")
+        bounds = np.searchsorted(ivf["assignment"][order], np.arange(1, len(ivf["centroids"])))
+        ivf["lists"] = np.split(order, bounds)
+
+    def _build_ivf(self) -> dict:
+        """Spherical k-means on a sample of live rows, then assigns every row to its nearest centroid."""
+        live = np.flatnonzero(self._alive[:len(self._ids)])
+        lists = min(self.ivf_lists, len(live))
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(live, size=min(len(live), 256 * lists), replace=False))
+        vectors = np.asarray(self._matrix[sample], dtype=np.float32)
+        centroids = vectors[rng.choice(len(vectors), size=lists, replace=False)]
+        for _ in range(10):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(lists):
+                members = vectors[assignment == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = _normalize(centroids)
+
+        assignment = np.empty(len(self._ids), dtype=np.int32)
+        for start in range(0, len(self._ids), self.block_rows):
+            block = np.asarray(self._matrix[start:start + self.block_rows], dtype=np.float32)
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        ivf = {"trained_rows": len(live), "centroids": centroids, "assignment": assignment}
+        self._partition(ivf)
+        return ivf
+
+    def _ivf_index(self):
+        live = len(self._row_of)
+        if self.ivf_lists <= 0 or live < self.ivf_min_rows:
+            return None
+        ivf = self._ivf
+        # Retrain once the corpus has doubled or halved since training; _reset drops it on compaction.
+        if ivf is None or not ivf["trained_rows"] / 2 <= live <= 2 * ivf["trained_rows"]:
+            ivf = self._ivf = self._build_ivf()
+        elif len(ivf["assignment"]) < len(self._ids):
+            # Rows appended since the partition was trained go to their nearest centroid.
+            block = np.asarray(self._matrix[len(ivf["assignment"]):], dtype=np.float32)
+            nearest = np.argmax(block @ ivf["centroids"].T, axis=1).astype(np.int32)
+            ivf["assignment"] = np.concatenate([ivf["assignment"], nearest])
+            self._partition(ivf)
+        return ivf
+
+    def _ivf_search(self, ivf: dict, queries: np.ndarray, k: int) -> tuple:
+        probe = min(self.ivf_probe, len(ivf["centroids"]))
+        nearest = np.argpartition(-(queries @ ivf["centroids"].T), probe - 1, axis=1)[:, :probe]
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, (query, lists) in enumerate(zip(queries, nearest)):
+            candidates = np.concatenate([ivf["lists"][c] for c in lists])
+            candidates = np.sort(candidates[self._alive[candidates]])
+            found = self._merge_top(
+                (np.zeros((1, 0), np.float32), np.zeros((1, 0), np.int64)),
+                (np.asarray(self._matrix[candidates], dtype=np.float32) @ query)[None, :], candidates, k
+            )
+            width = found[0].shape[1]
+            scores[q, :width], rows[q, :width] = found[0][0], found[1][0]
+        return scores, rows
+
+    def search_vectors(self, vectors, k: int = 4) -> list:
+        """Top-k [(id, cosine similarity), ...] per query vector, best first."""
+        queries = _normalize(np.atleast_2d(vectors))
+        with self._lock:
+            self._refresh()
+            if not self._row_of or k <= 0:
+                return [[] for _ in queries]
+            k = min(k, len(self._row_of))
+            ivf = self._ivf_index()
+            scores, rows = self._ivf_search(ivf, queries, k) if ivf is not None else self._exact(queries, k)
+            order = np.argsort(-scores, axis=1)
+            return [
+                [(self._ids[rows[q, j]], float(scores[q, j])) for j in order[q] if rows[q, j] >= 0 and np.isfinite(scores[q, j])]
+                for q in range(len(queries))
+            ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list:
+        """[(Document, cosine distance)] best first, like Chroma's (lower is closer)."""
+        vector = self.embedding_function.embed_query(query)
+        with self._lock:
+            hits = self.search_vectors(vector, k)[0]
+            return [
+                (Document(page_content=self._texts[self._row_of[doc_id]], metadata=self._metadatas[self._row_of[doc_id]]), 1.0 - score)
+                for doc_id, score in hits
+            ]
+
+    def similarity_search(self, query: str, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def as_retriever(self, search_type: str = "similarity", search_kwargs: dict = None) -> MmapRetriever:
+        if search_type != "similarity":
+            raise ValueError(f"MmapVectorStore only supports similarity search, not {search_type!r}.")
+        return MmapRetriever(store=self, k=(search_kwargs or {}).get("k", 4))
@@ -0,0 +1,152 @@
+# prefetch.py
+
+import os
+import copy
+import json
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from generate_suggested_questions import generate_suggested_questions, agenerate_suggested_questions
+
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", 4))
+PREFETCH_MAX_ENTRIES = int(os.getenv("PREFETCH_MAX_ENTRIES", 256))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+    return _executor
+
+
+def suggested_questions_fingerprint(user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str) -> str:
+    """Hash of every input that reaches the suggested-question prompt."""
+    payload = json.dumps(
+        [user_choices, rag_context, conversation_history, sub_process_name],
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _prefetch_key(owner: str, user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str) -> str:
+    return f"{owner}\0{suggested_questions_fingerprint(user_choices, rag_context, conversation_history, sub_process_name)}"
+
+
+class SuggestedQuestionPrefetcher:
+    """
+    Generates the suggested question for an upcoming subprocess on a shared
+    worker pool while the user is still answering the current one.
+
+    Results are keyed by the owner (the session) and a fingerprint of all
+    prompt inputs. If the history changes after a prefetch was started (e.g.
+    a follow-up answer is submitted), the stale result simply no longer
+    matches; submitting again for the same owner and subprocess supersedes
+    it. Superseding only cancels work that has not started yet, so callers
+    should submit once per submitted answer, not on every render.
+    """
+
+    def __init__(self, max_entries: int = PREFETCH_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str, owner: str = "") -> str:
+        """Starts generating in the background unless an identical prefetch exists. Returns its key."""
+        user_choices = copy.deepcopy(user_choices)
+        conversation_history = copy.deepcopy(conversation_history)
+        key = _prefetch_key(owner, user_choices, rag_context, conversation_history, sub_process_name)
+        slot = (owner, sub_process_name)
+
+        with self._lock:
+            if key in self._futures:
+                self._futures.move_to_end(key)
+                return key
+            for stale_key, (stale_slot, stale_future) in list(self._futures.items()):
+                if stale_slot == slot:
+                    stale_future.cancel()
+                    del self._futures[stale_key]
+            future = _get_executor().submit(
+                generate_suggested_questions,
+                user_choices=user_choices,
+                rag_context=rag_context,
+                conversation_history=conversation_history,
+                sub_process_name=sub_process_name,
+            )
+            self._futures[key] = (slot, future)
+            while len(self._futures) > self.max_entries:
+                _, (_, evicted) = self._futures.popitem(last=False)
+                evicted.cancel()
+        return key
+
+    def result(self, user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str,
+               owner: str = "", timeout: float = None):
+        """
+        Returns the prefetched questions for exactly these inputs, waiting for
+        an in-flight prefetch if needed, or None if there is no usable one.
+        """
+        key = _prefetch_key(owner, user_choices, rag_context, conversation_history, sub_process_name)
+        with self._lock:
+            entry = self._futures.pop(key, None)
+        if entry is None:
+            return None
+        try:
+            return entry[1].result(timeout=timeout)
+        except Exception as e:
+            print(f"Prefetched question unavailable, generating inline: {e}")
+            return None
+
+
+class AsyncSuggestedQuestionPrefetcher:
+    """
+    Event-loop equivalent of SuggestedQuestionPrefetcher for the FastAPI
+    backend; prefetches run as tasks through the shared LLM limiter. One
+    instance serves every session, so pass the session ID as `owner`.
+    """
+
+    def __init__(self, max_entries: int = PREFETCH_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._tasks = OrderedDict()
+
+    def submit(self, user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str, owner: str = "") -> str:
+        user_choices = copy.deepcopy(user_choices)
+        conversation_history = copy.deepcopy(conversation_history)
+        key = _prefetch_key(owner, user_choices, rag_context, conversation_history, sub_process_name)
+        slot = (owner, sub_process_name)
+
+        if key in self._tasks:
+            self._tasks.move_to_end(key)
+            return key
+        for stale_key, (stale_slot, stale_task) in list(self._tasks.items()):
+            if stale_slot == slot:
+                stale_task.cancel()
+                del self._tasks[stale_key]
+        task = asyncio.create_task(agenerate_suggested_questions(
+            user_choices=user_choices,
+            rag_context=rag_context,
+            conversation_history=conversation_history,
+            sub_process_name=sub_process_name,
+        ))
+        self._tasks[key] = (slot, task)
+        while len(self._tasks) > self.max_entries:
+            _, (_, evicted) = self._tasks.popitem(last=False)
+            evicted.cancel()
+        return key
+
+    async def result(self, user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str, owner: str = ""):
+        key = _prefetch_key(owner, user_choices, rag_context, conversation_history, sub_process_name)
+        entry = self._tasks.pop(key, None)
+        if entry is None:
+            return None
+        try:
+            return await entry[1]
+        except Exception as e:
+            print(f"Prefetched question unavailable, generating inline: {e}")
+            return None
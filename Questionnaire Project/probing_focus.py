@@ -1,5 +1,14 @@
 # probing_focus.py
 
+import os
+import re
+import threading
+
+import numpy as np
+
+from core.lru import LRUCache
+from core.models import embeddings_instance
+
 PROBING_DATABASE = {
     "Sourcing Projects": {
         "Organizational Scope & Complexity": "Ask about multi-entity project governance, cross-ERP data consistency, and approval workflows spanning regions.",
@@ -41,14 +50,133 @@ PROBING_DATABASE = {
 }
 
 
+# USER_CHOICES keys for the four client dimensions, and keys that describe
+# the engagement rather than a dimension and are never matched. Any other key
+# (e.g. a renamed or newly added dimension) is matched against the dimension
+# index by embedding.
+DIMENSION_KEYS = {
+    "organization_scope": "Organizational Scope & Complexity",
+    "supply_chain_complexity": "Supply Chain & Procurement Complexity",
+    "compliance_risk_governance": "Compliance, Risk & Governance",
+    "sustainability_objectives": "Sustainability & Strategic Sourcing Objectives",
+}
+NON_DIMENSION_KEYS = {"product", "module", "activity", "questionnaire_type", "industry", "company_size"}
+
+# Ada-style embeddings score even unrelated short texts around 0.7, so a
+# match needs both a high similarity and a clear lead over the runner-up.
+PROBING_SUBPROCESS_THRESHOLD = float(os.getenv("PROBING_SUBPROCESS_THRESHOLD", 0.8))
+PROBING_DIMENSION_THRESHOLD = float(os.getenv("PROBING_DIMENSION_THRESHOLD", 0.85))
+PROBING_MATCH_MARGIN = float(os.getenv("PROBING_MATCH_MARGIN", 0.05))
+PROBING_RESOLVED_MAX_ENTRIES = int(os.getenv("PROBING_RESOLVED_MAX_ENTRIES", 1000))
+
+_indexes = {}
+_resolved = LRUCache(PROBING_RESOLVED_MAX_ENTRIES)
+_index_lock = threading.Lock()
+
+
+def normalize_key(text: str) -> str:
+    """Lower-cases, spells out '&' and drops punctuation/underscores so near-identical names compare equal."""
+    text = text.lower().replace("&", " and ").replace("_", " ")
+    return " ".join(re.sub(r"[^a-z0-9 ]+", " ", text).split())
+
+
+def _index_keys(kind: str) -> list:
+    if kind == "subprocess":
+        return list(PROBING_DATABASE)
+    return sorted({dimension for probes in PROBING_DATABASE.values() for dimension in probes})
+
+
+def _build_index(kind: str):
+    """
+    Returns (keys, row-normalised embedding matrix) for the probing
+    subprocesses or dimensions. Built with one embedding call and memoised
+    for the life of the process.
+    """
+    with _index_lock:
+        index = _indexes.get(kind)
+        if index is not None:
+            return index
+        keys = _index_keys(kind)
+        if kind == "subprocess":
+            # The probe lines describe what a subprocess covers, which helps
+            # free-form names like "Bid Evaluation" land on "Negotiation and Bidding".
+            texts = [f"{key}: " + " ".join(PROBING_DATABASE[key].values()) for key in keys]
+        else:
+            texts = keys
+        matrix = np.asarray(embeddings_instance.embed_documents(texts), dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        index = _indexes[kind] = (keys, matrix)
+        return index
+
+
+def _best_match(keys: list, row: np.ndarray, threshold: float):
+    order = np.argsort(-row)
+    best = row[order[0]]
+    runner_up = row[order[1]] if len(order) > 1 else -1.0
+    return keys[order[0]] if best >= threshold and best - runner_up >= PROBING_MATCH_MARGIN else None
+
+
+def _resolve(kind: str, names: list, threshold: float) -> dict:
+    """
+    Maps each name to its nearest key of the given index (or None), embedding
+    all unseen names at once. If embedding fails only exact (normalised) name
+    matches are resolved, and the rest are retried on the next call.
+    """
+    normalized = {normalize_key(key): key for key in _index_keys(kind)}
+    result = {}
+    pending = []
+    for name in dict.fromkeys(names):
+        cached = _resolved.get((kind, name), False)
+        if cached is not False:
+            result[name] = cached
+        elif normalize_key(name) in normalized:
+            result[name] = normalized[normalize_key(name)]
+            _resolved.put((kind, name), result[name])
+        else:
+            pending.append(name)
+
+    if pending:
+        try:
+            keys, matrix = _build_index(kind)
+            vectors = np.asarray(embeddings_instance.embed_documents([normalize_key(name) for name in pending]), dtype=np.float32)
+        except Exception as e:
+            print(f"Probing focus matching unavailable, using exact names only: {e}")
+            return dict(result, **{name: None for name in pending})
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        for name, row in zip(pending, vectors @ matrix.T):
+            result[name] = _best_match(keys, row, threshold)
+            _resolved.put((kind, name), result[name])
+    return result
+
+
+def resolve_subprocesses(subprocess_names: list) -> dict:
+    """
+    Maps extracted subprocess names onto PROBING_DATABASE subprocesses
+    ({name: key or None}). Call it once with the whole extracted list to
+    resolve every name in a single embedding call; results are memoised.
+    """
+    return _resolve("subprocess", subprocess_names, PROBING_SUBPROCESS_THRESHOLD)
+
+
+def resolve_dimensions(choice_keys: list) -> dict:
+    """Maps USER_CHOICES keys onto PROBING_DATABASE dimensions ({key: dimension or None})."""
+    result = {key: DIMENSION_KEYS[key] for key in choice_keys if key in DIMENSION_KEYS}
+    result.update({key: None for key in choice_keys if key in NON_DIMENSION_KEYS})
+    others = [key for key in choice_keys if key not in result]
+    if others:
+        result.update(_resolve("dimension", others, PROBING_DIMENSION_THRESHOLD))
+    return result
+
+
 def get_llm_probing_focus(subprocess: str, user_choices: dict) -> str:
     """
     Get a string of probing guidance lines based on the subprocess and dimension values chosen by the user.
     """
     probes = []
-    subprocess_probes = PROBING_DATABASE.get(subprocess, {})
+    subprocess_key = resolve_subprocesses([subprocess])[subprocess]
+    subprocess_probes = PROBING_DATABASE.get(subprocess_key, {})
 
-    for dimension, value in user_choices.items():
+    for dimension in dict.fromkeys(resolve_dimensions(list(user_choices)).values()):
         if dimension in subprocess_probes:
             probes.append(subprocess_probes[dimension])
 
@@ -1,26 +1,169 @@
+import os
+import json
+import asyncio
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
 from core.models import llm_instance
+from core.concurrency import ainvoke_limited, llm_limiter
+from core.lru import LRUCache
+from core.metrics import instrument
+from history_utils import (
+    EARLIER_DISCUSSION,
+    aformat_history_for_prompt,
+    clip_to_tokens,
+    format_entries_for_prompt,
+    format_history_entry,
+    format_history_for_prompt,
+)
+from prompt_builder import LayeredPrompt
+from document_sections import replace_section, section_title, split_sections
+
+RECOMMENDATION_HISTORY_TOKEN_BUDGET = int(os.getenv("RECOMMENDATION_HISTORY_TOKEN_BUDGET", 12000))
+# "map_reduce" drafts one section per subprocess concurrently and adds a short
+# overview; "single" writes the whole recommendation in one completion.
+RECOMMENDATION_MODE = os.getenv("RECOMMENDATION_MODE", "map_reduce")
+RECOMMENDATION_SECTION_WORKERS = int(os.getenv("RECOMMENDATION_SECTION_WORKERS", 8))
+RECOMMENDATION_SECTION_CACHE_MAX_ENTRIES = int(os.getenv("RECOMMENDATION_SECTION_CACHE_MAX_ENTRIES", 1000))
+# Token budget of the reduce prompt; each section contributes at most an equal
+# share of it, taken from its beginning (heading and first design points).
+RECOMMENDATION_OVERVIEW_TOKEN_BUDGET = int(os.getenv("RECOMMENDATION_OVERVIEW_TOKEN_BUDGET", 6000))
+
+_section_cache = LRUCache(RECOMMENDATION_SECTION_CACHE_MAX_ENTRIES)
+
+
+PROCESS_UNDERSTANDING_PROMPT = LayeredPrompt(
+    static=(
+        "You are a SAP consultant. Based on the conversation history below, summarize the user's current sourcing process.\n"
+        "Give a summary of the user's current process understanding in bullet points.\n"
+    ),
+    dynamic="Conversation history:\n\n{conversation_history}\n",
+)
+
 
+def build_process_understanding_prompt(conversation_history: list, formatted_history: str = None) -> list:
+    if formatted_history is None:
+        formatted_history = format_history_for_prompt(conversation_history)
+    return PROCESS_UNDERSTANDING_PROMPT.format_messages(conversation_history=formatted_history)
 
+
+@instrument("process_understanding")
 def generate_process_understanding(conversation_history: list) -> str:
     """
     Generates a bullet-point summary of the user's As-Is process understanding.
     """
-    prompt = f"You are a SAP consultant. Based on this conversation history, summarize the user's current sourcing process:\n\n"
-    for i, item in enumerate(conversation_history, 1):
-        prompt += f"Q{i}: {item['question']}\nA{i}: {item['answer']}\n"
-        for j, fup in enumerate(item['followups'], 1):
-            prompt += f"  ↳ F{j}: {fup['question']}\n     A: {fup['answer']}\n"
-    prompt += "\nGive a summary of the user's current process understanding in bullet points."
-
+    prompt = build_process_understanding_prompt(conversation_history)
     response = llm_instance.invoke(prompt)
     return response.content.strip()
 
 
-def update_process_understanding_with_input(conversation_history: list, user_input: str, current_understanding: str) -> str:
+@instrument("process_understanding")
+async def agenerate_process_understanding(conversation_history: list) -> str:
     """
-    Updates the process understanding summary based on user input.
+    Async variant of generate_process_understanding, admitted through the shared LLM limiter.
+    """
+    prompt = build_process_understanding_prompt(conversation_history, await aformat_history_for_prompt(conversation_history))
+    response = await ainvoke_limited(llm_instance, prompt)
+    return response.content.strip()
+
+
+@instrument("process_understanding")
+async def astream_process_understanding(conversation_history: list):
+    """
+    Streams the process understanding summary token by token as it is generated.
+    """
+    prompt = build_process_understanding_prompt(conversation_history, await aformat_history_for_prompt(conversation_history))
+    async with llm_limiter.slot():
+        async for chunk in llm_instance.astream(prompt):
+            if chunk.content:
+                yield chunk.content
+
+
+def history_entry_digest(entry: dict) -> str:
+    """Fingerprint of one Q&A entry, including its follow-ups and their answers."""
+    payload = json.dumps({
+        "question": entry["question"],
+        "answer": entry["answer"],
+        "followups": [[f["question"], f["answer"]] for f in entry.get("followups", [])],
+    }, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def needs_full_understanding(conversation_history: list, current_summary: str, watermark: list, full_rebuild: bool = False) -> bool:
+    """True when the summary has to be rebuilt from the whole history rather than updated."""
+    return full_rebuild or not current_summary or len(watermark or []) > len(conversation_history)
+
+
+def plan_incremental_understanding(conversation_history: list, current_summary: str, watermark: list, full_rebuild: bool = False,
+                                   formatted_history: str = None):
+    """
+    Decides how to bring the summary up to date with the history.
+
+    `watermark` holds the digests of the entries the summary already covers,
+    in order. Returns (prompt, new_watermark); prompt is None when the summary
+    is already current. Entries past the watermark are folded in as new, and
+    entries whose digest changed (e.g. follow-up answers filled in later) are
+    folded in as updates. A full rebuild is planned when requested, when there
+    is no summary yet, or when the history no longer extends the watermark.
     """
-    correction_prompt = f"""You are a SAP consultant. Here is the current summary of the user's sourcing process:
+    digests = [history_entry_digest(entry) for entry in conversation_history]
+    watermark = watermark or []
+
+    if needs_full_understanding(conversation_history, current_summary, watermark, full_rebuild):
+        return build_process_understanding_prompt(conversation_history, formatted_history), digests
+
+    changed = [
+        i for i, digest in enumerate(digests)
+        if i >= len(watermark) or watermark[i] != digest
+    ]
+    if not changed:
+        return None, digests
+
+    prompt = f"You are a SAP consultant. Here is the current bullet-point summary of the user's sourcing process:\n\n{current_summary}\n\n"
+    prompt += "The following discovery Q&A has been captured since it was written. Entries marked UPDATED supersede what the summary says about the same question:\n\n"
+    for i in changed:
+        marker = " (UPDATED)" if i < len(watermark) else ""
+        prompt += format_history_entry(i + 1, conversation_history[i], marker)
+    prompt += (
+        "\nReturn the complete updated summary in bullet points. Keep bullet points that are still accurate, "
+        "revise any that the new answers contradict, and add bullet points for new information."
+    )
+    return prompt, digests
+
+
+@instrument("process_understanding")
+def update_process_understanding_incremental(conversation_history: list, current_summary: str = "", watermark: list = None, full_rebuild: bool = False) -> tuple:
+    """
+    Folds only the Q&A entries not yet covered by `current_summary` into it.
+    Returns (summary, watermark); pass both back in on the next turn.
+    """
+    prompt, new_watermark = plan_incremental_understanding(conversation_history, current_summary, watermark, full_rebuild)
+    if prompt is None:
+        return current_summary, new_watermark
+    response = llm_instance.invoke(prompt)
+    return response.content.strip(), new_watermark
+
+
+@instrument("process_understanding")
+async def aupdate_process_understanding_incremental(conversation_history: list, current_summary: str = "", watermark: list = None, full_rebuild: bool = False) -> tuple:
+    """
+    Async variant of update_process_understanding_incremental.
+    """
+    formatted_history = None
+    if needs_full_understanding(conversation_history, current_summary, watermark, full_rebuild):
+        formatted_history = await aformat_history_for_prompt(conversation_history)
+    prompt, new_watermark = await asyncio.to_thread(
+        plan_incremental_understanding, conversation_history, current_summary, watermark, full_rebuild, formatted_history
+    )
+    if prompt is None:
+        return current_summary, new_watermark
+    response = await ainvoke_limited(llm_instance, prompt)
+    return response.content.strip(), new_watermark
+
+
+def build_understanding_correction_prompt(user_input: str, current_understanding: str) -> str:
+    return f"""You are a SAP consultant. Here is the current summary of the user's sourcing process:
 
 {current_understanding}
 
@@ -28,15 +171,204 @@ The user has provided the following correction or addition:
 {user_input}
 
 Please regenerate a revised and corrected process understanding summary, integrating the user's input clearly and accurately, in bullet points."""
-    response = llm_instance.invoke(correction_prompt)
-    return response.content.strip()
 
 
-def generate_process_recommendation(conversation_history: list) -> str:
+def build_recommendation_correction_prompt(user_input: str, current_recommendation: str) -> str:
+    return f"""You are a senior SAP Ariba consultant. Here is the current process recommendation for SAP Ariba Sourcing:
+
+{current_recommendation}
+
+The user has provided the following correction or addition:
+{user_input}
+
+Please regenerate the revised and corrected process recommendation, integrating the user's input clearly and accurately, keeping its structure and headings."""
+
+
+REVISION_ROUTING_PROMPT = LayeredPrompt(
+    static=(
+        "You are a SAP consultant maintaining a document that is split into numbered sections.\n"
+        "Given the outline of the document and a correction or addition from the user, decide which sections "
+        "must change to integrate it. Pick as few sections as possible. If the input adds information that "
+        "belongs in none of the existing sections, set \"new_section\" to true.\n\n"
+        "Respond with JSON only, in the form {{\"sections\": [2, 5], \"new_section\": false}}.\n"
+    ),
+    dynamic="Document: {document_kind}\n\nOutline:\n{outline}\n\nUser correction or addition:\n{user_input}\n",
+)
+
+SECTION_REVISION_PROMPT = LayeredPrompt(
+    static=(
+        "You are a SAP consultant revising one section of a document. Integrate the user's correction or addition "
+        "into the section clearly and accurately. Keep the section's heading, format and every statement the "
+        "correction does not affect. Return only the revised section. If the correction means the section "
+        "should be removed entirely, return nothing.\n"
+    ),
+    dynamic=(
+        "Document: {document_kind}\n\nOutline of the whole document:\n{outline}\n\n"
+        "Section to revise:\n{section}\n\nUser correction or addition:\n{user_input}\n"
+    ),
+)
+
+NEW_SECTION_PROMPT = LayeredPrompt(
+    static=(
+        "You are a SAP consultant adding to a document. Write one new section that captures the user's input, "
+        "in the same format and style as the existing sections (a heading if they have headings, otherwise "
+        "bullet points). Do not repeat what the existing sections already say. Return only the new section.\n"
+    ),
+    dynamic="Document: {document_kind}\n\nOutline of the whole document:\n{outline}\n\nUser input:\n{user_input}\n",
+)
+
+
+def document_outline(sections: list) -> str:
+    return "\n".join(f"{i}. {section_title(section)}" for i, section in enumerate(sections, 1))
+
+
+def parse_revision_route(content: str, section_count: int) -> tuple:
+    """Parses the routing response into (section indices, new section?); raises ValueError if malformed."""
+    text = content.strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"No JSON object in revision routing response: {text[:200]!r}")
+    route = json.loads(text[start:end + 1])
+    numbers = route.get("sections", [])
+    if not isinstance(numbers, list) or not all(isinstance(n, int) and 1 <= n <= section_count for n in numbers):
+        raise ValueError(f"Malformed section list: {numbers!r}")
+    indices = sorted(set(n - 1 for n in numbers))
+    return indices, bool(route.get("new_section")) or not indices
+
+
+def plan_section_revisions(document_kind: str, sections: list, user_input: str, route_content: str):
     """
-    Generates a detailed SAP Ariba process recommendation based on discovery conversation.
+    Turns the routing response into [(section index or None for a new section, prompt), ...],
+    or None when the route cannot be parsed and the whole document should be revised instead.
+    """
+    try:
+        indices, new_section = parse_revision_route(route_content, len(sections))
+    except ValueError as e:
+        print(f"Revision routing failed, revising the whole document: {e}")
+        return None
+    outline = document_outline(sections)
+    plan = [
+        (i, SECTION_REVISION_PROMPT.format_messages(
+            document_kind=document_kind, outline=outline, section=sections[i].strip(), user_input=user_input
+        ))
+        for i in indices
+    ]
+    if new_section:
+        plan.append((None, NEW_SECTION_PROMPT.format_messages(document_kind=document_kind, outline=outline, user_input=user_input)))
+    return plan
+
+
+def apply_section_revisions(sections: list, plan: list, revisions: list) -> str:
+    """Patches revised sections in place; sections not in the plan are kept byte-for-byte."""
+    patched = list(sections)
+    added = []
+    for (index, _), revised in zip(plan, revisions):
+        if index is None:
+            if revised.strip():
+                added.append(revised.strip())
+        else:
+            patched[index] = replace_section(sections[index], revised)
+    document = "".join(patched)
+    if added:
+        # Separate new sections the way the existing ones are separated.
+        separator = sections[-2][len(sections[-2].rstrip()):] if len(sections) > 1 else "\n\n"
+        document = document.rstrip() + separator + separator.join(added)
+    return document
+
+
+def revise_document(document_kind: str, document: str, user_input: str, build_full_prompt) -> str:
+    """
+    Section-scoped revision: a short routing call picks the sections the
+    correction touches, only those are regenerated (in parallel) and patched
+    in place. Documents with a single section, or a routing response that
+    cannot be parsed, fall back to revising the whole document.
+    """
+    sections = split_sections(document)
+    plan = None
+    if len(sections) > 1:
+        route = llm_instance.invoke(REVISION_ROUTING_PROMPT.format_messages(
+            document_kind=document_kind, outline=document_outline(sections), user_input=user_input
+        ))
+        plan = plan_section_revisions(document_kind, sections, user_input, route.content)
+    if plan is None:
+        return llm_instance.invoke(build_full_prompt(user_input, document)).content.strip()
+
+    with ThreadPoolExecutor(max_workers=min(RECOMMENDATION_SECTION_WORKERS, len(plan))) as pool:
+        contexts = [contextvars.copy_context() for _ in plan]
+        responses = pool.map(lambda ctx, item: ctx.run(llm_instance.invoke, item[1]), contexts, plan)
+        revisions = [response.content for response in responses]
+    return apply_section_revisions(sections, plan, revisions)
+
+
+async def arevise_document(document_kind: str, document: str, user_input: str, build_full_prompt) -> str:
+    """
+    Async variant of revise_document, admitted through the shared LLM limiter.
+    """
+    sections = split_sections(document)
+    plan = None
+    if len(sections) > 1:
+        route = await ainvoke_limited(llm_instance, REVISION_ROUTING_PROMPT.format_messages(
+            document_kind=document_kind, outline=document_outline(sections), user_input=user_input
+        ))
+        plan = plan_section_revisions(document_kind, sections, user_input, route.content)
+    if plan is None:
+        response = await ainvoke_limited(llm_instance, build_full_prompt(user_input, document))
+        return response.content.strip()
+
+    responses = await asyncio.gather(*(ainvoke_limited(llm_instance, prompt) for _, prompt in plan))
+    return apply_section_revisions(sections, plan, [response.content for response in responses])
+
+
+@instrument("understanding_correction")
+def revise_process_understanding(current_summary: str, user_input: str) -> str:
+    """
+    Integrates the user's correction into the process understanding summary,
+    regenerating only the bullet points it affects.
+    """
+    return revise_document("process understanding summary (bullet points)", current_summary, user_input, build_understanding_correction_prompt)
+
+
+@instrument("understanding_correction")
+async def arevise_process_understanding(current_summary: str, user_input: str) -> str:
+    """
+    Async variant of revise_process_understanding.
+    """
+    return await arevise_document("process understanding summary (bullet points)", current_summary, user_input, build_understanding_correction_prompt)
+
+
+@instrument("recommendation_correction")
+def revise_process_recommendation(current_recommendation: str, user_input: str) -> str:
+    """
+    Integrates the user's correction into the process recommendation,
+    regenerating only the sections it affects.
+    """
+    return revise_document("SAP Ariba Sourcing process recommendation", current_recommendation, user_input, build_recommendation_correction_prompt)
+
+
+@instrument("recommendation_correction")
+async def arevise_process_recommendation(current_recommendation: str, user_input: str) -> str:
+    """
+    Async variant of revise_process_recommendation.
     """
-    design_prompt = """
+    return await arevise_document("SAP Ariba Sourcing process recommendation", current_recommendation, user_input, build_recommendation_correction_prompt)
+
+
+def update_process_understanding_with_input(conversation_history: list, user_input: str, current_understanding: str) -> str:
+    """
+    Updates the process understanding summary based on user input.
+    """
+    return revise_process_understanding(current_understanding, user_input)
+
+
+async def aupdate_process_understanding_with_input(conversation_history: list, user_input: str, current_understanding: str) -> str:
+    """
+    Async variant of update_process_understanding_with_input.
+    """
+    return await arevise_process_understanding(current_understanding, user_input)
+
+
+PROCESS_RECOMMENDATION_PROMPT = LayeredPrompt(
+    static="""
 You are a senior SAP Ariba consultant in a BBP discovery session.
 
 Your task:
@@ -51,12 +383,230 @@ Formatting Instructions:
 - Use clear SAP/Ariba terminology as used in real BBPs.
 - Give headings and content for each section point.
 
-Here is the discovery Q&A:
-"""
-    for item in conversation_history:
-        design_prompt += f"Q: {item['question']}\nA: {item['answer']}\n"
-        for f in item.get("followups", []):
-            design_prompt += f"↳ Follow-up: {f['question']}\nAnswer: {f['answer']}\n"
+""",
+    dynamic="Here is the discovery Q&A:\n{conversation_history}\n",
+)
+
+
+def build_process_recommendation_prompt(conversation_history: list, formatted_history: str = None) -> list:
+    if formatted_history is None:
+        formatted_history = format_history_for_prompt(conversation_history, token_budget=RECOMMENDATION_HISTORY_TOKEN_BUDGET)
+    return PROCESS_RECOMMENDATION_PROMPT.format_messages(conversation_history=formatted_history)
+
+
+async def abuild_process_recommendation_prompt(conversation_history: list) -> list:
+    formatted_history = await aformat_history_for_prompt(conversation_history, token_budget=RECOMMENDATION_HISTORY_TOKEN_BUDGET)
+    return build_process_recommendation_prompt(conversation_history, formatted_history)
+
+
+RECOMMENDATION_SECTION_PROMPT = LayeredPrompt(
+    static="""
+You are a senior SAP Ariba consultant in a BBP discovery session.
+
+Your task:
+Based on the discovery Q&A below, write the process recommendation section for ONE sub-process of SAP Ariba Sourcing, tailored to the client's current practices, business goals, and IT environment.
+
+Key Instructions:
+- Start with a heading that is exactly the sub-process name, followed by sub-headings for the design points.
+- Focus on real, actionable design changes — not general advice.
+- Be specific about what is enabled/configured in Ariba — e.g., “Auto-publish enabled for RFQ after approval,” or “Standard template with 5 mandatory fields applied to all sourcing events.”
+- Cover only this sub-process; other sub-processes are written separately.
+
+Formatting Instructions:
+- Use clear SAP/Ariba terminology as used in real BBPs.
+
+""",
+    dynamic="Sub-process: {sub_process_name}\n\nDiscovery Q&A for this sub-process:\n{conversation_history}\n",
+)
+
+RECOMMENDATION_OVERVIEW_PROMPT = LayeredPrompt(
+    static="""
+You are a senior SAP Ariba consultant in a BBP discovery session.
+
+Below are the process recommendation sections already written for each sub-process of SAP Ariba Sourcing. Long sections are abbreviated to their opening; the full sections follow your text in the final document.
+
+Your task:
+Write the opening of the recommendation document that precedes them:
+- A heading "Overview" with a short summary of the target sourcing design.
+- A heading "Cross-Process Design Decisions" covering what spans sub-processes: roles and approvals, integrations, master data, templates shared between sub-processes, and any conflicts between the sections with the recommended resolution.
+
+Do not repeat the sections themselves. Use clear SAP/Ariba terminology as used in real BBPs.
+
+""",
+    dynamic="Sub-process sections:\n\n{sections}\n",
+)
+
+
+def group_history_by_subprocess(conversation_history: list) -> list:
+    """[(subprocess, [(index, entry), ...]), ...] in order of first appearance; indices are 1-based."""
+    groups = {}
+    for index, entry in enumerate(conversation_history, 1):
+        groups.setdefault(entry.get("subprocess") or EARLIER_DISCUSSION, []).append((index, entry))
+    return list(groups.items())
+
+
+def recommendation_section_key(sub_process_name: str, indexed_entries: list) -> str:
+    digests = [history_entry_digest(entry) for _, entry in indexed_entries]
+    return hashlib.sha256(json.dumps([sub_process_name, digests]).encode("utf-8")).hexdigest()
+
+
+def build_recommendation_section_prompt(sub_process_name: str, indexed_entries: list) -> list:
+    return RECOMMENDATION_SECTION_PROMPT.format_messages(
+        sub_process_name=sub_process_name,
+        conversation_history=format_entries_for_prompt(indexed_entries, RECOMMENDATION_HISTORY_TOKEN_BUDGET),
+    )
 
+
+def plan_recommendation_sections(conversation_history: list) -> tuple:
+    """
+    Splits the history into per-subprocess sections. Returns (sections, pending):
+    `sections` lists [subprocess, text or None] in order, and `pending` holds
+    (position, cache key, prompt) for every section not in the cache yet, so
+    an answer change in one subprocess only regenerates that section.
+    """
+    sections, pending = [], []
+    for sub_process_name, indexed_entries in group_history_by_subprocess(conversation_history):
+        key = recommendation_section_key(sub_process_name, indexed_entries)
+        cached = _section_cache.get(key)
+        sections.append([sub_process_name, cached])
+        if cached is None:
+            pending.append((len(sections) - 1, key, build_recommendation_section_prompt(sub_process_name, indexed_entries)))
+    return sections, pending
+
+
+def _store_section(sections: list, position: int, key: str, text: str):
+    _section_cache.put(key, text)
+    sections[position][1] = text
+
+
+def build_recommendation_overview_prompt(sections: list) -> list:
+    share = max(1, RECOMMENDATION_OVERVIEW_TOKEN_BUDGET // max(1, len(sections)))
+    return RECOMMENDATION_OVERVIEW_PROMPT.format_messages(
+        sections="\n\n".join(clip_to_tokens(text, share) for _, text in sections)
+    )
+
+
+def merge_recommendation(overview: str, sections: list) -> str:
+    return "\n\n".join([overview.strip()] + [text for _, text in sections])
+
+
+def use_map_reduce(conversation_history: list) -> bool:
+    return RECOMMENDATION_MODE == "map_reduce" and len(group_history_by_subprocess(conversation_history)) > 1
+
+
+def generate_process_recommendation_map_reduce(conversation_history: list) -> str:
+    """
+    Map: one recommendation section per subprocess, generated in parallel and
+    cached by the Q&A it was written from. Reduce: a short overview with the
+    cross-process decisions, placed in front of the sections. The reduce step
+    writes only the overview, so latency is bounded by the longest section
+    rather than the length of the whole document.
+    """
+    sections, pending = plan_recommendation_sections(conversation_history)
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(RECOMMENDATION_SECTION_WORKERS, len(pending))) as pool:
+            # Each worker runs in a copy of this context so its LLM calls stay attributed to this stage.
+            contexts = [contextvars.copy_context() for _ in pending]
+            responses = pool.map(lambda ctx, item: ctx.run(llm_instance.invoke, item[2]), contexts, pending)
+            for (position, key, _), response in zip(pending, responses):
+                _store_section(sections, position, key, response.content.strip())
+    overview = llm_instance.invoke(build_recommendation_overview_prompt(sections))
+    return merge_recommendation(overview.content, sections)
+
+
+async def aiter_drafted_sections(sections: list, pending: list):
+    """
+    Drafts the pending sections concurrently, admitted through the shared LLM
+    limiter, and yields each position as soon as its text is stored, so the
+    caller can use a section without waiting for the slowest one.
+    """
+    tasks = {
+        asyncio.ensure_future(ainvoke_limited(llm_instance, prompt)): (position, key)
+        for position, key, prompt in pending
+    }
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                position, key = tasks.pop(task)
+                _store_section(sections, position, key, task.result().content.strip())
+                yield position
+    finally:
+        # A consumer that stops early (e.g. a closed stream) must not leave drafts running.
+        for task in tasks:
+            task.cancel()
+
+
+async def adraft_recommendation_sections(conversation_history: list) -> list:
+    """Fills in every uncached section concurrently, admitted through the shared LLM limiter."""
+    sections, pending = await asyncio.to_thread(plan_recommendation_sections, conversation_history)
+    async for _ in aiter_drafted_sections(sections, pending):
+        pass
+    return sections
+
+
+async def agenerate_process_recommendation_map_reduce(conversation_history: list) -> str:
+    """
+    Async variant of generate_process_recommendation_map_reduce.
+    """
+    sections = await adraft_recommendation_sections(conversation_history)
+    overview = await ainvoke_limited(llm_instance, await asyncio.to_thread(build_recommendation_overview_prompt, sections))
+    return merge_recommendation(overview.content, sections)
+
+
+@instrument("process_recommendation")
+def generate_process_recommendation(conversation_history: list) -> str:
+    """
+    Generates a detailed SAP Ariba process recommendation based on discovery conversation.
+    """
+    if use_map_reduce(conversation_history):
+        return generate_process_recommendation_map_reduce(conversation_history)
+    design_prompt = build_process_recommendation_prompt(conversation_history)
     response = llm_instance.invoke(design_prompt)
     return response.content.strip()
+
+
+@instrument("process_recommendation")
+async def agenerate_process_recommendation(conversation_history: list) -> str:
+    """
+    Async variant of generate_process_recommendation, admitted through the shared LLM limiter.
+    """
+    if use_map_reduce(conversation_history):
+        return await agenerate_process_recommendation_map_reduce(conversation_history)
+    design_prompt = await abuild_process_recommendation_prompt(conversation_history)
+    response = await ainvoke_limited(llm_instance, design_prompt)
+    return response.content.strip()
+
+
+@instrument("process_recommendation")
+async def astream_process_recommendation(conversation_history: list):
+    """
+    Streams the process recommendation token by token as it is generated.
+    In map-reduce mode cached sections are sent at once and every other section
+    as soon as it is drafted, in completion order; the overview needs all of
+    them, so it is streamed last.
+    """
+    if not use_map_reduce(conversation_history):
+        design_prompt = await abuild_process_recommendation_prompt(conversation_history)
+        async with llm_limiter.slot():
+            async for chunk in llm_instance.astream(design_prompt):
+                if chunk.content:
+                    yield chunk.content
+        return
+
+    sections, pending = await asyncio.to_thread(plan_recommendation_sections, conversation_history)
+    separator = ""
+    for _, text in sections:
+        if text is not None:
+            yield separator + text
+            separator = "\n\n"
+    async for position in aiter_drafted_sections(sections, pending):
+        yield separator + sections[position][1]
+        separator = "\n\n"
+
+    overview_prompt = await asyncio.to_thread(build_recommendation_overview_prompt, sections)
+    yield separator
+    async with llm_limiter.slot():
+        async for chunk in llm_instance.astream(overview_prompt):
+            if chunk.content:
+                yield chunk.content
@@ -0,0 +1,72 @@
+# prompt_builder.py
+
+import string
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+_formatter = string.Formatter()
+
+
+class CompiledTemplate:
+    """
+    A str.format-style template parsed once into literal and field segments.
+    Fields may index into mappings, e.g. "{user_choices[industry]}", and take
+    conversions and format specs ("{x!r}", "{n:>5}") exactly as str.format does.
+    Literal braces are written doubled, as with str.format.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.segments = []
+        self.fields = set()
+        for literal, field_name, format_spec, conversion in _formatter.parse(template):
+            if field_name is not None:
+                if field_name == "" or field_name.isdigit():
+                    raise ValueError("Templates only take named fields.")
+                self.fields.add(field_name)
+                # A spec may itself contain fields, e.g. "{x:>{width}}".
+                if format_spec and "{" in format_spec:
+                    format_spec = CompiledTemplate(format_spec)
+                    self.fields |= format_spec.fields
+            self.segments.append((literal, field_name, format_spec, conversion))
+
+    def render(self, values: dict) -> str:
+        parts = []
+        for literal, field_name, format_spec, conversion in self.segments:
+            parts.append(literal)
+            if field_name is not None:
+                value, _ = _formatter.get_field(field_name, (), values)
+                if conversion:
+                    value = _formatter.convert_field(value, conversion)
+                if isinstance(format_spec, CompiledTemplate):
+                    format_spec = format_spec.render(values)
+                parts.append(_formatter.format_field(value, format_spec or ""))
+        return "".join(parts)
+
+
+class LayeredPrompt:
+    """
+    Chat prompt assembled in a fixed order so that provider-side prompt
+    caching can reuse the longest possible prefix:
+
+    1. static     -- persona and instructions, identical for every call
+                     (system message, must not contain fields);
+    2. semi_static -- context that only changes between sub-processes or
+                     sessions, such as user choices and RAG context;
+    3. dynamic    -- what changes on every call, such as the conversation
+                     history and the current answer.
+    """
+
+    def __init__(self, static: str, semi_static: str = "", dynamic: str = ""):
+        static_template = CompiledTemplate(static)
+        if static_template.fields:
+            raise ValueError(f"Static prompt layer must not contain fields: {sorted(static_template.fields)}")
+        self.static = static_template.render({})
+        self.semi_static = CompiledTemplate(semi_static)
+        self.dynamic = CompiledTemplate(dynamic)
+
+    def format_messages(self, **values) -> list:
+        return [
+            SystemMessage(content=self.static),
+            HumanMessage(content=self.semi_static.render(values) + self.dynamic.render(values)),
+        ]
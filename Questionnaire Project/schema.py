@@ -12,6 +12,7 @@ class ConversationEntry(BaseModel):
     question: str
     answer: str
     followups: List[FollowUp] = []
+    subprocess: Optional[str] = None
  
 # --- Request body for process understanding / recommendation ---
 class ConversationHistoryRequest(BaseModel):
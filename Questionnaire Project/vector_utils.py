@@ -1,53 +1,657 @@
 # vector_utils.py
 
 import os
-from langchain_community.vectorstores.chroma import Chroma
-from langchain_community.document_loaders import Docx2txtLoader, PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from core.models import embeddings_instance
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from core.models import embeddings_instance, EMBEDDING_MODEL_NAME
+from core.metrics import instrument, record_retrieval
+from lexical_index import BM25Index
+
+try:
+    import fcntl
+except ImportError:  # Windows: index writers are only serialised within one process
+    fcntl = None
+
+DOCS_FOLDER = os.getenv("DOCS_FOLDER", "docs")
+VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH", "vectorstore")
+
+# Vector index: "chroma" (persistent HNSW) or "mmap", a memory-mapped float16
+# matrix shared by all worker processes through the page cache, searched
+# exactly or, with VECTOR_IVF_LISTS > 0 on large corpora, through an IVF
+# partition probing VECTOR_IVF_PROBE lists.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_IVF_LISTS = int(os.getenv("VECTOR_IVF_LISTS", 0))
+VECTOR_IVF_PROBE = int(os.getenv("VECTOR_IVF_PROBE", 8))
+VECTOR_IVF_MIN_ROWS = int(os.getenv("VECTOR_IVF_MIN_ROWS", 20000))
+VECTOR_MMAP_DTYPE = os.getenv("VECTOR_MMAP_DTYPE", "float16")
+
+# Each backend keeps its own manifest, so switching backends never skips indexing.
+MANIFEST_FILENAME = "manifest.json" if VECTOR_BACKEND == "chroma" else f"manifest-{VECTOR_BACKEND}.json"
+MANIFEST_PATH = os.path.join(VECTOR_DB_PATH, MANIFEST_FILENAME)
+MANIFEST_VERSION = 1
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+
+# Ingestion: files are parsed and split on a process pool, chunks are
+# embedded and written in batches of EMBED_BATCH_SIZE as each file completes.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", min(4, os.cpu_count() or 1)))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 256))
+INGEST_PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", 5.0))
+
+# Retrieval for build_rag_context: "hybrid" fuses BM25 and vector scores and
+# answers short all-known-keyword queries lexically; "vector" and "lexical"
+# use one method only.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", 0.5))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+LEXICAL_FAST_PATH_MAX_TERMS = int(os.getenv("LEXICAL_FAST_PATH_MAX_TERMS", 3))
+
+SUBPROCESS_CONTEXT_INDEX_PATH = os.path.join("cache", "subprocess_contexts.json")
+
+_vectorstore = None
+_retrievers = {}
+_vectorstore_lock = threading.Lock()
+_subprocess_context_lock = threading.Lock()
+_chunk_matrix = None
+_lexical_index = None
+
+
+SUPPORTED_EXTENSIONS = (".docx", ".pdf")
+
+
+def _get_loader(file_path: str):
+    """Returns the document loader for a supported file, or None."""
+    from langchain_community.document_loaders import Docx2txtLoader, PyMuPDFLoader
+
+    if file_path.endswith(".docx"):
+        return Docx2txtLoader(file_path)
+    if file_path.endswith(".pdf"):
+        return PyMuPDFLoader(file_path)
+    return None
+
+
+def _list_source_files() -> list:
+    """Lists the supported source files in the docs folder, sorted by name."""
+    return sorted(
+        filename for filename in os.listdir(DOCS_FOLDER)
+        if filename.endswith(SUPPORTED_EXTENSIONS)
+    )
+
+
+def _load_path(file_path: str, raise_errors: bool = False) -> list:
+    loader = _get_loader(file_path)
+    try:
+        return loader.load()
+    except Exception as e:
+        print(f"Failed to load {loader}: {e}")
+        if raise_errors:
+            raise
+        return []
+
+
+def load_file(filename: str) -> list:
+    """Loads a single .docx or .pdf file from the docs folder."""
+    return _load_path(os.path.join(DOCS_FOLDER, filename))
+
+
+def _ingest_pool(file_count: int):
+    """
+    Process pool for parsing, or None when a pool would not pay off. Workers
+    are spawned rather than forked: the API loads the store from a background
+    thread, and forking a threaded process can deadlock the child.
+    """
+    workers = min(INGEST_WORKERS, file_count)
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
 
-DOCS_FOLDER = "docs"
-VECTOR_DB_PATH = "vectorstore"
 
 def load_documents():
-    """Loads .docx and .pdf documents from the docs folder."""
-    loaders = []
-    for filename in os.listdir(DOCS_FOLDER):
-        file_path = os.path.join(DOCS_FOLDER, filename)
-        if filename.endswith(".docx"):
-            loaders.append(Docx2txtLoader(file_path))
-        elif filename.endswith(".pdf"):
-            loaders.append(PyMuPDFLoader(file_path))
-
-    documents = []
-    for loader in loaders:
-        try:
-            documents.extend(loader.load())
-        except Exception as e:
-            print(f"Failed to load {loader}: {e}")
-    return documents
-
-def create_or_load_vectorstore(documents):
-    """Creates or loads the Chroma vectorstore."""
-    if os.path.exists(VECTOR_DB_PATH):
-        return Chroma(persist_directory=VECTOR_DB_PATH, embedding_function=embeddings_instance)
-
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-    split_docs = text_splitter.split_documents(documents)
-
-    vectorstore = Chroma.from_documents(
-        documents=split_docs,
-        embedding=embeddings_instance,
-        persist_directory=VECTOR_DB_PATH
+    """Loads .docx and .pdf documents from the docs folder, in parallel when there are several."""
+    paths = [os.path.join(DOCS_FOLDER, filename) for filename in _list_source_files()]
+    pool = _ingest_pool(len(paths))
+    if pool is None:
+        loaded = map(_load_path, paths)
+    else:
+        with pool:
+            loaded = list(pool.map(_load_path, paths))
+    return [document for documents in loaded for document in documents]
+
+
+def _hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _chunk_id(filename: str, content: str, occurrence: int) -> str:
+    """
+    Content-addressed chunk ID. Unchanged chunks keep their ID across edits of
+    the surrounding file, so only genuinely new text has to be embedded.
+    """
+    key = f"{filename}\0{occurrence}\0{content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _assign_chunk_ids(filename: str, chunks: list) -> tuple:
+    """Gives every chunk of one file its content-addressed ID; returns (chunk_ids, chunks)."""
+    seen = {}
+    chunk_ids = []
+    for chunk in chunks:
+        occurrence = seen.get(chunk.page_content, 0)
+        seen[chunk.page_content] = occurrence + 1
+        chunk_id = _chunk_id(filename, chunk.page_content, occurrence)
+        chunk.metadata["chunk_id"] = chunk_id
+        chunk_ids.append(chunk_id)
+    return chunk_ids, chunks
+
+
+def _parse_and_split(docs_folder: str, filename: str, chunk_size: int, chunk_overlap: int) -> tuple:
+    """
+    Process-pool task: loads and splits one file, returning
+    (filename, chunk_ids, [(page_content, metadata)]) so only plain data
+    crosses the process boundary. chunk_ids is None if the file could not be
+    loaded, which is not the same as a file without text.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    try:
+        documents = _load_path(os.path.join(docs_folder, filename), raise_errors=True)
+    except Exception:
+        return filename, None, []
+    chunk_ids, chunks = _assign_chunk_ids(filename, text_splitter.split_documents(documents))
+    return filename, chunk_ids, [(chunk.page_content, chunk.metadata) for chunk in chunks]
+
+
+def _iter_split_files(filenames: list):
+    """
+    Yields (filename, chunk_ids, chunks) for each file as soon as it has been
+    parsed. With a pool, at most two files per worker are in flight so memory
+    stays bounded however large the archive is.
+    """
+    from langchain_core.documents import Document
+
+    max_in_flight = 2 * min(INGEST_WORKERS, len(filenames))
+    pool = _ingest_pool(len(filenames))
+    if pool is None:
+        for filename in filenames:
+            _, chunk_ids, chunks = _parse_and_split(DOCS_FOLDER, filename, CHUNK_SIZE, CHUNK_OVERLAP)
+            yield filename, chunk_ids, [Document(page_content=text, metadata=meta) for text, meta in chunks]
+        return
+
+    with pool:
+        queue = list(reversed(filenames))
+        running = set()
+        while queue or running:
+            while queue and len(running) < max_in_flight:
+                running.add(pool.submit(_parse_and_split, DOCS_FOLDER, queue.pop(), CHUNK_SIZE, CHUNK_OVERLAP))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename, chunk_ids, chunks = future.result()
+                yield filename, chunk_ids, [Document(page_content=text, metadata=meta) for text, meta in chunks]
+
+
+class IngestProgress:
+    """Prints files/chunks done and throughput at most every `interval` seconds."""
+
+    def __init__(self, total_files: int, interval: float = INGEST_PROGRESS_INTERVAL):
+        self.total_files = total_files
+        self.interval = interval
+        self.files = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def update(self, files: int = 0, chunks: int = 0):
+        self.files += files
+        self.chunks += chunks
+        now = time.perf_counter()
+        if self.interval and now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = self.elapsed
+        rate = self.chunks / elapsed if elapsed else 0.0
+        print(f"[ingest] {self.files}/{self.total_files} files, {self.chunks} chunks embedded, "
+              f"{rate:.1f} chunks/s, {elapsed:.1f}s elapsed")
+
+
+def _empty_manifest() -> dict:
+    return {
+        "version": MANIFEST_VERSION,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "files": {},
+    }
+
+
+def load_manifest():
+    """Returns the ingestion manifest, or None if the store has never been indexed with one."""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict):
+    os.makedirs(VECTOR_DB_PATH, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _open_vectorstore():
+    if VECTOR_BACKEND == "mmap":
+        from mmap_vector_store import MmapVectorStore
+
+        return MmapVectorStore(
+            os.path.join(VECTOR_DB_PATH, "mmap"),
+            embeddings_instance,
+            ivf_lists=VECTOR_IVF_LISTS,
+            ivf_probe=VECTOR_IVF_PROBE,
+            ivf_min_rows=VECTOR_IVF_MIN_ROWS,
+            dtype=VECTOR_MMAP_DTYPE,
+        )
+    if VECTOR_BACKEND != "chroma":
+        raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+    from langchain_community.vectorstores.chroma import Chroma
+
+    return Chroma(persist_directory=VECTOR_DB_PATH, embedding_function=embeddings_instance)
+
+
+def _sync_lexical_index(vectorstore, added_ids=(), added_texts=(), removed_ids=()):
+    """Mirrors writes to the shared vectorstore into the lexical index, once that has been built."""
+    index = _lexical_index
+    if index is None or vectorstore is not _vectorstore:
+        return
+    if removed_ids:
+        index.remove(removed_ids)
+    if added_ids:
+        index.add(added_ids, added_texts)
+
+
+def reindex(vectorstore=None) -> dict:
+    """
+    Brings the vectorstore in line with the docs folder.
+
+    Each source file is hashed and compared against the manifest. Only added or
+    changed files are re-split, only chunks whose content hash is new are
+    embedded, and chunks that no longer exist are deleted. A store that predates
+    the manifest is rebuilt once, since its chunk IDs cannot be matched.
+    """
+    if vectorstore is None:
+        vectorstore = _open_vectorstore()
+
+    manifest = load_manifest()
+    settings_changed = manifest is not None and (
+        manifest.get("version") != MANIFEST_VERSION
+        or manifest.get("chunk_size") != CHUNK_SIZE
+        or manifest.get("chunk_overlap") != CHUNK_OVERLAP
+        or manifest.get("embedding_model", EMBEDDING_MODEL_NAME) != EMBEDDING_MODEL_NAME
     )
-    return vectorstore
+    if manifest is None or settings_changed:
+        legacy_ids = vectorstore.get(include=[])["ids"]
+        if legacy_ids:
+            vectorstore.delete(ids=legacy_ids)
+            _sync_lexical_index(vectorstore, removed_ids=legacy_ids)
+        manifest = _empty_manifest()
+
+    stats = {"added": 0, "deleted": 0, "changed_files": [], "removed_files": [], "failed_files": [], "unchanged_files": 0}
 
+    indexed_files = manifest["files"]
+    current_files = _list_source_files()
+
+    file_hashes = {}
+    for filename in current_files:
+        file_hash = _hash_file(os.path.join(DOCS_FOLDER, filename))
+        entry = indexed_files.get(filename)
+        if entry and entry["hash"] == file_hash:
+            stats["unchanged_files"] += 1
+        else:
+            file_hashes[filename] = file_hash
+
+    progress = IngestProgress(len(file_hashes))
+    for filename, chunk_ids, chunks in _iter_split_files(list(file_hashes)):
+        if chunk_ids is None:
+            # A failed load keeps the file's old chunks and manifest entry, so
+            # the next reindex retries it instead of treating it as empty.
+            stats["failed_files"].append(filename)
+            progress.update(files=1)
+            continue
+        entry = indexed_files.get(filename)
+        old_ids = set(entry["chunks"]) if entry else set()
+        new_ids = set(chunk_ids)
+
+        to_add = [(cid, chunk) for cid, chunk in zip(chunk_ids, chunks) if cid not in old_ids]
+        to_delete = sorted(old_ids - new_ids)
+
+        for start in range(0, len(to_add), EMBED_BATCH_SIZE):
+            batch = to_add[start:start + EMBED_BATCH_SIZE]
+            vectorstore.add_documents(
+                documents=[chunk for _, chunk in batch],
+                ids=[cid for cid, _ in batch],
+            )
+            _sync_lexical_index(
+                vectorstore, added_ids=[cid for cid, _ in batch], added_texts=[chunk.page_content for _, chunk in batch]
+            )
+            progress.update(chunks=len(batch))
+        if to_delete:
+            vectorstore.delete(ids=to_delete)
+            _sync_lexical_index(vectorstore, removed_ids=to_delete)
+
+        # The manifest only records a file once all of its chunks are stored.
+        indexed_files[filename] = {"hash": file_hashes[filename], "chunks": chunk_ids}
+        save_manifest(manifest)
+        progress.update(files=1)
+
+        stats["added"] += len(to_add)
+        stats["deleted"] += len(to_delete)
+        stats["changed_files"].append(filename)
+
+    if file_hashes:
+        progress.report()
+    stats["seconds"] = round(progress.elapsed, 3)
+
+    for filename in sorted(set(indexed_files) - set(current_files)):
+        stale_ids = indexed_files.pop(filename)["chunks"]
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+            _sync_lexical_index(vectorstore, removed_ids=stale_ids)
+        save_manifest(manifest)
+        stats["deleted"] += len(stale_ids)
+        stats["removed_files"].append(filename)
+
+    if not os.path.exists(MANIFEST_PATH):
+        save_manifest(manifest)
+    return stats
+
+
+def get_vectorstore():
+    """
+    Returns the process-wide vectorstore handle.
+
+    The store is opened and synced with the docs folder once, on first use;
+    source files are only parsed if the manifest says they changed.
+    """
+    global _vectorstore
+    if _vectorstore is None:
+        with _vectorstore_lock:
+            if _vectorstore is None:
+                vectorstore = _open_vectorstore()
+                reindex(vectorstore)
+                _vectorstore = vectorstore
+    return _vectorstore
+
+
+def vectorstore_ready() -> bool:
+    """True once the shared vectorstore has been opened and synced."""
+    return _vectorstore is not None
+
+
+def get_retriever(k: int = 4):
+    """Returns a shared similarity retriever over the vectorstore for the given k."""
+    retriever = _retrievers.get(k)
+    if retriever is None:
+        vectorstore = get_vectorstore()
+        with _vectorstore_lock:
+            retriever = _retrievers.setdefault(
+                k, vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": k})
+            )
+    return retriever
+
+
+def refresh_vectorstore() -> dict:
+    """Re-syncs the shared vectorstore with the docs folder and returns the reindex stats."""
+    vectorstore = get_vectorstore()
+    with _vectorstore_lock:
+        return reindex(vectorstore)
+
+
+def get_corpus_fingerprint() -> str:
+    """
+    Fingerprint of the indexed corpus: changes whenever a source file, the
+    way files are chunked, or the embedding model changes. Syncs the shared
+    vectorstore first.
+    """
+    get_vectorstore()
+    manifest = load_manifest() or _empty_manifest()
+    payload = json.dumps({
+        "version": manifest["version"],
+        "embedding_model": manifest.get("embedding_model", EMBEDDING_MODEL_NAME),
+        "chunk_size": manifest["chunk_size"],
+        "chunk_overlap": manifest["chunk_overlap"],
+        "files": {name: entry["hash"] for name, entry in manifest["files"].items()},
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def create_or_load_vectorstore(documents=None):
+    """
+    Creates or loads the vectorstore and syncs it with the docs folder.
+
+    `documents` is accepted for backwards compatibility only; what gets embedded
+    is decided by the ingestion manifest, see `reindex`.
+    """
+    return get_vectorstore()
+
+
+def get_lexical_index() -> BM25Index:
+    """
+    Returns the BM25 index over every chunk in the shared vectorstore. It is
+    built from the stored chunk texts on first use and afterwards kept in step
+    with the store by reindex.
+    """
+    global _lexical_index
+    if _lexical_index is None:
+        vectorstore = get_vectorstore()
+        with _vectorstore_lock:
+            if _lexical_index is None:
+                data = vectorstore.get(include=["documents"])
+                index = BM25Index()
+                index.add(data["ids"], data["documents"])
+                _lexical_index = index
+    return _lexical_index
+
+
+def _normalize_scores(scores: dict) -> dict:
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {key: 1.0 for key in scores}
+    return {key: (value - low) / (high - low) for key, value in scores.items()}
+
+
+def search_chunks(query: str, k: int = 4, mode: str = None) -> list:
+    """
+    Top-k chunk texts for a query.
+
+    In "hybrid" mode a query of at most LEXICAL_FAST_PATH_MAX_TERMS terms that
+    all occur in the corpus (e.g. "RFx", "Award Scenario") is answered from the
+    BM25 index alone, without an embedding call. Other queries take the top
+    HYBRID_CANDIDATES from both BM25 and vector search, min-max normalise each
+    score list and rank by their weighted sum.
+    """
+    mode = mode or RETRIEVAL_MODE
+    start = time.perf_counter()
+    if mode == "vector":
+        texts = [doc.page_content for doc in get_retriever(k).invoke(query)]
+        record_retrieval("vector", time.perf_counter() - start, [len(texts)])
+        return texts
+
+    index = get_lexical_index()
+    terms, known = index.known_terms(query)
+    if mode == "lexical" or (terms and len(terms) <= LEXICAL_FAST_PATH_MAX_TERMS and known == len(terms)):
+        hits = index.search(query, k)
+        if hits or mode == "lexical":
+            texts = [index.text(doc_id) for doc_id, _ in hits]
+            record_retrieval("lexical", time.perf_counter() - start, [len(texts)])
+            return texts
+
+    texts = {}
+    dense = {}
+    for doc, distance in get_vectorstore().similarity_search_with_score(query, k=HYBRID_CANDIDATES):
+        doc_id = doc.metadata.get("chunk_id", doc.page_content)
+        texts[doc_id] = doc.page_content
+        dense[doc_id] = -distance
+    lexical = dict(index.search(query, HYBRID_CANDIDATES))
+    for doc_id in lexical:
+        texts.setdefault(doc_id, index.text(doc_id))
+
+    dense, lexical = _normalize_scores(dense), _normalize_scores(lexical)
+    fused = {
+        doc_id: HYBRID_VECTOR_WEIGHT * dense.get(doc_id, 0.0) + (1 - HYBRID_VECTOR_WEIGHT) * lexical.get(doc_id, 0.0)
+        for doc_id in texts
+    }
+    ranked = sorted(fused, key=lambda doc_id: -fused[doc_id])[:k]
+    record_retrieval("hybrid", time.perf_counter() - start, [len(ranked)])
+    return [texts[doc_id] for doc_id in ranked]
+
+
+@instrument("rag_context")
 def build_rag_context(k: int = 4, query: str = "SAP Ariba sourcing discovery questions") -> str:
     """
-    Load documents, create/load vectorstore, and return RAG context for a query.
+    Return RAG context for a query from the shared vectorstore.
+    """
+    return "\n\n".join(search_chunks(query, k))
+
+
+def _load_chunk_matrix() -> tuple:
+    """
+    Returns (documents, matrix) for every indexed chunk, with the embeddings as
+    a row-normalised float32 matrix. Cached in memory per corpus version.
+    """
+    global _chunk_matrix
+    fingerprint = get_corpus_fingerprint()
+    cached = _chunk_matrix
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1], cached[2]
+
+    data = get_vectorstore().get(include=["embeddings", "documents"])
+    matrix = np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["documents"]), -1)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    _chunk_matrix = (fingerprint, data["documents"], matrix)
+    return data["documents"], matrix
+
+
+def retrieve_batch(queries: list, k: int = 4) -> list:
+    """
+    Top-k chunk texts for many queries at once: one embedding call for all
+    queries and one matrix product plus partial sort for the top-k.
     """
-    documents = load_documents()
-    vectorstore = create_or_load_vectorstore(documents)
-    retriever = vectorstore.as_retriever(search_type="similarity", k=k)
-    chunks = retriever.invoke(query)
-    return "\n\n".join(doc.page_content for doc in chunks)
+    start = time.perf_counter()
+    if VECTOR_BACKEND == "mmap":
+        # The mapped matrix is searched in place rather than copied into a float32 one.
+        vectorstore = get_vectorstore()
+        if not queries:
+            return []
+        hits = vectorstore.search_vectors(embeddings_instance.embed_documents(queries), k)
+        results = [[vectorstore.text(doc_id) for doc_id, _ in row] for row in hits]
+        record_retrieval("batch", time.perf_counter() - start, [len(row) for row in results])
+        return results
+
+    documents, matrix = _load_chunk_matrix()
+    if not queries or not documents:
+        return [[] for _ in queries]
+
+    query_matrix = np.asarray(embeddings_instance.embed_documents(queries), dtype=np.float32)
+    query_matrix /= np.maximum(np.linalg.norm(query_matrix, axis=1, keepdims=True), 1e-12)
+    scores = query_matrix @ matrix.T
+
+    k = min(k, len(documents))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    ranked = np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+    results = [[documents[j] for j in row] for row in ranked]
+    record_retrieval("batch", time.perf_counter() - start, [len(row) for row in results])
+    return results
+
+
+def _read_subprocess_context_index(key: str) -> dict:
+    """The persisted context index for `key`; a missing, stale or unreadable file counts as empty."""
+    try:
+        with open(SUBPROCESS_CONTEXT_INDEX_PATH, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("key") == key and isinstance(stored.get("contexts"), dict):
+            return stored
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"Ignoring unreadable subprocess context index: {e}")
+    return {"key": key, "contexts": {}}
+
+
+@contextlib.contextmanager
+def _subprocess_context_index_lock():
+    """Serialises index writers across threads and, where flock exists, across worker processes."""
+    with _subprocess_context_lock:
+        with open(SUBPROCESS_CONTEXT_INDEX_PATH + ".lock", "a+b") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def build_subprocess_contexts(subprocess_names: list, k: int = 4) -> dict:
+    """
+    Returns {subprocess name: RAG context} for every name. Contexts are kept
+    in a persisted index keyed by corpus version, k and embedding deployment;
+    only names not in the index are retrieved, all in one batch. Writers
+    merge into the latest index under a lock and replace it atomically, so
+    concurrent requests and workers never lose each other's entries.
+    """
+    key = json.dumps([get_corpus_fingerprint(), k, EMBEDDING_MODEL_NAME])
+    contexts = dict(_read_subprocess_context_index(key)["contexts"])
+
+    missing = [name for name in dict.fromkeys(subprocess_names) if name not in contexts]
+    if missing:
+        retrieved = {name: "\n\n".join(chunks) for name, chunks in zip(missing, retrieve_batch(missing, k))}
+        contexts.update(retrieved)
+        directory = os.path.dirname(SUBPROCESS_CONTEXT_INDEX_PATH) or "."
+        os.makedirs(directory, exist_ok=True)
+        with _subprocess_context_index_lock():
+            index = _read_subprocess_context_index(key)
+            index["contexts"].update(retrieved)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".subprocess_contexts-", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(index, f, indent=2, ensure_ascii=False)
+                os.replace(tmp_path, SUBPROCESS_CONTEXT_INDEX_PATH)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+                raise
+
+    return {name: contexts[name] for name in subprocess_names}
+
+if __name__ == "__main__":
+    result = reindex()
+    print("✅ Reindex complete:")
+    print(f"  Changed files:   {', '.join(result['changed_files']) or 'none'}")
+    print(f"  Removed files:   {', '.join(result['removed_files']) or 'none'}")
+    print(f"  Failed files:    {', '.join(result['failed_files']) or 'none'}")
+    print(f"  Unchanged files: {result['unchanged_files']}")
+    print(f"  Chunks added:    {result['added']}")
+    print(f"  Chunks deleted:  {result['deleted']}")
+    print(f"  Ingest time:     {result['seconds']}s")